@@ -1,210 +1,224 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Request
-from typing import Dict, Any, Optional
-from app.services.browser_service import BrowserService
+from fastapi import APIRouter, Query, Request, status
+from fastapi.responses import Response, StreamingResponse
+from typing import Annotated, Optional
+from pydantic import AnyHttpUrl, BaseModel
+from app.services.browser_service import BrowserService, aiter_text_chunks
 from app.services.session_service import SessionManager
 from app.core.logging import get_logger
-from app.core.exceptions import (
-    BrowserAutomationError,
-    SessionNotFoundError,
-    NavigationError,
-    ElementError,
-    InvalidURLError,
-    ElementNotFoundError,
-    ElementNotInteractableError,
-    InvalidSelectorError
-)
+from app.core.responses import ORJSONResponse
+from app.core.exceptions import SessionNotFoundError
 
 router = APIRouter()
 logger = get_logger(__name__)
 
-# Dependency to get BrowserService and SessionManager instances
-# In a real application, these would be managed by FastAPI's dependency injection
-# For simplicity, we'll assume they are attached to the app instance
-def get_browser_service(request: Request) -> BrowserService:
-    return request.app.browser_service
+# BrowserService and SessionManager are app-wide singletons stored on app.state in
+# app/main.py; handlers read them straight from the request instead of going through
+# Depends() so no dependency resolution runs per request.
+#
+# Handlers don't catch BrowserAutomationError: the single exception handler in
+# app/main.py maps each subclass to its status code and logs it.
+#
+# No response_model on these routes: a Dict[str, Any] model constrains nothing but
+# still costs a validation pass per response.
 
-def get_session_manager(request: Request) -> SessionManager:
-    return request.app.session_manager
+# Query models for routes with several parameters: pydantic-core parses and coerces the
+# whole query string in one pass instead of FastAPI validating each parameter separately.
+class CreateSessionQuery(BaseModel):
+    session_id: Optional[str] = None
+    browser_type: Optional[str] = "chromium"
+    headless: Optional[bool] = None
+    viewport_width: Optional[int] = None
+    viewport_height: Optional[int] = None
+    context_id: Optional[str] = None
+    default_timeout: Optional[int] = None
 
-@router.post("/session", summary="Create a new browser session", response_model=Dict[str, Any])
+class NavigateQuery(BaseModel):
+    url: AnyHttpUrl
+    wait_until: Optional[str] = "load"
+    verbose: bool = False
+
+class ClickQuery(BaseModel):
+    selector: str
+    timeout: Optional[int] = None
+    verbose: bool = False
+
+class TypeQuery(BaseModel):
+    selector: str
+    text: str
+    timeout: Optional[int] = None
+    verbose: bool = False
+
+class ScreenshotQuery(BaseModel):
+    full_page: Optional[bool] = False
+    encoding: Optional[str] = "base64"
+    image_format: Optional[str] = None
+    quality: Optional[int] = None
+
+def _no_content(session_id: str, **headers: str) -> Response:
+    """Empty 204 for mutating routes; identifiers travel in X- headers instead of a body."""
+    headers["X-Session-Id"] = session_id
+    return Response(status_code=status.HTTP_204_NO_CONTENT, headers=headers)
+
+@router.post("/session", summary="Create a new browser session")
 async def create_session(
-    session_id: Optional[str] = None,
-    browser_type: Optional[str] = "chromium",
-    headless: Optional[bool] = None,
-    viewport_width: Optional[int] = None,
-    viewport_height: Optional[int] = None,
-    browser_service: BrowserService = Depends(get_browser_service),
-    session_manager: SessionManager = Depends(get_session_manager)
+    request: Request,
+    q: Annotated[CreateSessionQuery, Query()]
 ):
-    try:
-        session_info = await browser_service.create_session(
-            session_id=session_id,
-            browser_type=browser_type,
-            headless=headless,
-            viewport_width=viewport_width,
-            viewport_height=viewport_height
-        )
-        await session_manager.register_session(session_info["session_id"], session_info)
-        logger.info(f"API: Session {session_info['session_id']} created successfully.")
-        return {"session_id": session_info['session_id'], "message": "Session created successfully."}
-    except BrowserAutomationError as e:
-        logger.error(f"API: Failed to create session: {e.message}", exc_info=True)
-        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=e.message)
-
-@router.delete("/session/{session_id}", summary="Close a browser session", response_model=Dict[str, Any])
+    browser_service: BrowserService = request.app.state.browser_service
+    session_manager: SessionManager = request.app.state.session_manager
+    session_info = await browser_service.create_session(
+        session_id=q.session_id,
+        browser_type=q.browser_type,
+        headless=q.headless,
+        viewport_width=q.viewport_width,
+        viewport_height=q.viewport_height,
+        context_id=q.context_id,
+        default_timeout=q.default_timeout
+    )
+    await session_manager.register_session(session_info["session_id"], session_info)
+    logger.info("API: Session %s created successfully.", session_info['session_id'])
+    return {"session_id": session_info['session_id'], "message": "Session created successfully."}
+
+@router.delete("/session/{session_id}", summary="Close a browser session", status_code=status.HTTP_204_NO_CONTENT)
 async def close_session(
+    request: Request,
     session_id: str,
-    browser_service: BrowserService = Depends(get_browser_service),
-    session_manager: SessionManager = Depends(get_session_manager)
+    verbose: bool = False
 ):
-    try:
-        await browser_service.close_session(session_id)
-        await session_manager.unregister_session(session_id)
-        logger.info(f"API: Session {session_id} closed successfully.")
-        return {"session_id": session_id, "message": "Session closed successfully."}
-    except SessionNotFoundError as e:
-        logger.warning(f"API: Attempted to close non-existent session {session_id}.")
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=e.message)
-    except BrowserAutomationError as e:
-        logger.error(f"API: Failed to close session {session_id}: {e.message}", exc_info=True)
-        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=e.message)
-
-@router.post("/session/{session_id}/navigate", summary="Navigate to a URL", response_model=Dict[str, Any])
+    browser_service: BrowserService = request.app.state.browser_service
+    session_manager: SessionManager = request.app.state.session_manager
+    await browser_service.close_session(session_id)
+    # The manager may already have dropped an idle session on its own
+    await session_manager.unregister_session(session_id, missing_ok=True)
+    logger.info("API: Session %s closed successfully.", session_id)
+    if verbose:
+        return ORJSONResponse({"session_id": session_id, "message": "Session closed successfully."})
+    return _no_content(session_id)
+
+@router.post("/session/{session_id}/navigate", summary="Navigate to a URL", status_code=status.HTTP_204_NO_CONTENT)
 async def navigate(
+    request: Request,
     session_id: str,
-    url: str,
-    wait_until: Optional[str] = "load",
-    browser_service: BrowserService = Depends(get_browser_service),
-    session_manager: SessionManager = Depends(get_session_manager)
+    q: Annotated[NavigateQuery, Query()]
 ):
-    try:
-        await browser_service.navigate(session_id, url, wait_until)
-        await session_manager.update_session_activity(session_id, "navigate", {"url": url})
-        logger.info(f"API: Session {session_id} navigated to {url}.")
-        return {"session_id": session_id, "url": url, "message": "Navigation successful."}
-    except (NavigationError, InvalidURLError) as e:
-        logger.error(f"API: Navigation failed for session {session_id} to {url}: {e.message}", exc_info=True)
-        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=e.message)
-    except SessionNotFoundError as e:
-        logger.warning(f"API: Navigation attempt on non-existent session {session_id}.")
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=e.message)
-    except BrowserAutomationError as e:
-        logger.error(f"API: An unexpected error occurred during navigation: {e.message}", exc_info=True)
-        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=e.message)
-
-@router.post("/session/{session_id}/click", summary="Click an element", response_model=Dict[str, Any])
+    browser_service: BrowserService = request.app.state.browser_service
+    session_manager: SessionManager = request.app.state.session_manager
+    # pydantic-core has already rejected malformed URLs (422) before any browser work.
+    url = str(q.url)
+    await browser_service.navigate(session_id, url, q.wait_until)
+    await session_manager.update_session_activity(session_id, "navigate", {"url": url})
+    logger.info("API: Session %s navigated to %s.", session_id, url)
+    if q.verbose:
+        return ORJSONResponse({"session_id": session_id, "url": url, "message": "Navigation successful."})
+    return _no_content(session_id, **{"X-Url": url})
+
+@router.post("/session/{session_id}/click", summary="Click an element", status_code=status.HTTP_204_NO_CONTENT)
 async def click_element(
+    request: Request,
     session_id: str,
-    selector: str,
-    timeout: Optional[int] = None,
-    browser_service: BrowserService = Depends(get_browser_service),
-    session_manager: SessionManager = Depends(get_session_manager)
+    q: Annotated[ClickQuery, Query()]
 ):
-    try:
-        await browser_service.click_element(session_id, selector, timeout)
-        await session_manager.update_session_activity(session_id, "click", {"selector": selector})
-        logger.info(f"API: Session {session_id} clicked element {selector}.")
-        return {"session_id": session_id, "selector": selector, "message": "Element clicked successfully."}
-    except (ElementError, ElementNotFoundError, ElementNotInteractableError, InvalidSelectorError) as e:
-        logger.error(f"API: Click failed for session {session_id} on {selector}: {e.message}", exc_info=True)
-        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=e.message)
-    except SessionNotFoundError as e:
-        logger.warning(f"API: Click attempt on non-existent session {session_id}.")
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=e.message)
-    except BrowserAutomationError as e:
-        logger.error(f"API: An unexpected error occurred during click: {e.message}", exc_info=True)
-        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=e.message)
-
-@router.post("/session/{session_id}/type", summary="Type text into an element", response_model=Dict[str, Any])
+    browser_service: BrowserService = request.app.state.browser_service
+    session_manager: SessionManager = request.app.state.session_manager
+    await browser_service.click_element(session_id, q.selector, q.timeout)
+    await session_manager.update_session_activity(session_id, "click", {"selector": q.selector})
+    logger.info("API: Session %s clicked element %s.", session_id, q.selector)
+    if q.verbose:
+        return ORJSONResponse({"session_id": session_id, "selector": q.selector, "message": "Element clicked successfully."})
+    return _no_content(session_id)
+
+@router.post("/session/{session_id}/type", summary="Type text into an element", status_code=status.HTTP_204_NO_CONTENT)
 async def type_text(
+    request: Request,
     session_id: str,
-    selector: str,
-    text: str,
-    timeout: Optional[int] = None,
-    browser_service: BrowserService = Depends(get_browser_service),
-    session_manager: SessionManager = Depends(get_session_manager)
+    q: Annotated[TypeQuery, Query()]
 ):
-    try:
-        await browser_service.type_text(session_id, selector, text, timeout)
-        await session_manager.update_session_activity(session_id, "type", {"selector": selector, "text_length": len(text)})
-        logger.info(f"API: Session {session_id} typed into element {selector}.")
-        return {"session_id": session_id, "selector": selector, "message": "Text typed successfully."}
-    except (ElementError, ElementNotFoundError, ElementNotInteractableError, InvalidSelectorError) as e:
-        logger.error(f"API: Type failed for session {session_id} on {selector}: {e.message}", exc_info=True)
-        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=e.message)
-    except SessionNotFoundError as e:
-        logger.warning(f"API: Type attempt on non-existent session {session_id}.")
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=e.message)
-    except BrowserAutomationError as e:
-        logger.error(f"API: An unexpected error occurred during type: {e.message}", exc_info=True)
-        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=e.message)
-
-@router.get("/session/{session_id}/content", summary="Get page HTML content", response_model=Dict[str, Any])
+    browser_service: BrowserService = request.app.state.browser_service
+    session_manager: SessionManager = request.app.state.session_manager
+    await browser_service.type_text(session_id, q.selector, q.text, q.timeout)
+    await session_manager.update_session_activity(session_id, "type", {"selector": q.selector, "text_length": len(q.text)})
+    logger.info("API: Session %s typed into element %s.", session_id, q.selector)
+    if q.verbose:
+        return ORJSONResponse({"session_id": session_id, "selector": q.selector, "message": "Text typed successfully."})
+    return _no_content(session_id)
+
+@router.get("/session/{session_id}/content", summary="Get page HTML content", deprecated=True)
 async def get_page_content(
+    request: Request,
+    session_id: str
+):
+    browser_service: BrowserService = request.app.state.browser_service
+    session_manager: SessionManager = request.app.state.session_manager
+    content = await browser_service.get_page_content(session_id)
+    await session_manager.update_session_activity(session_id, "get_content", {"content_length": len(content)})
+    logger.info("API: Session %s retrieved page content.", session_id)
+    # Page HTML can be large; returning the response directly skips jsonable_encoder.
+    return ORJSONResponse({"session_id": session_id, "content": content, "message": "Page content retrieved successfully."})
+
+@router.get("/session/{session_id}/content/raw", summary="Stream page content without a JSON envelope")
+async def get_page_content_raw(
+    request: Request,
     session_id: str,
-    browser_service: BrowserService = Depends(get_browser_service),
-    session_manager: SessionManager = Depends(get_session_manager)
+    selector: Optional[str] = None,
+    content_format: Optional[str] = "html"
 ):
-    try:
-        content = await browser_service.get_page_content(session_id)
-        await session_manager.update_session_activity(session_id, "get_content", {"content_length": len(content)})
-        logger.info(f"API: Session {session_id} retrieved page content.")
-        return {"session_id": session_id, "content": content, "message": "Page content retrieved successfully."}
-    except SessionNotFoundError as e:
-        logger.warning(f"API: Get content attempt on non-existent session {session_id}.")
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=e.message)
-    except BrowserAutomationError as e:
-        logger.error(f"API: Failed to get page content for session {session_id}: {e.message}", exc_info=True)
-        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=e.message)
-
-@router.get("/session/{session_id}/screenshot", summary="Take a screenshot", response_model=Dict[str, Any])
+    browser_service: BrowserService = request.app.state.browser_service
+    session_manager: SessionManager = request.app.state.session_manager
+    # Fetch before building the StreamingResponse so errors still map to a normal status.
+    content = await browser_service.get_page_content(session_id, selector=selector, content_format=content_format or "html")
+    await session_manager.update_session_activity(session_id, "get_content", {"content_length": len(content), "format": content_format})
+    logger.info("API: Session %s streamed page content.", session_id)
+    media_type = "text/plain" if content_format == "text" else "text/html"
+    # The body is UTF-8 bytes, so only the character count is known without encoding it all up front
+    return StreamingResponse(
+        aiter_text_chunks(content),
+        media_type=f"{media_type}; charset=utf-8",
+        headers={"X-Session-Id": session_id, "X-Content-Chars": str(len(content))}
+    )
+
+@router.get("/session/{session_id}/screenshot", summary="Take a screenshot")
 async def take_screenshot(
+    request: Request,
     session_id: str,
-    full_page: Optional[bool] = False,
-    encoding: Optional[str] = "base64",
-    browser_service: BrowserService = Depends(get_browser_service),
-    session_manager: SessionManager = Depends(get_session_manager)
+    q: Annotated[ScreenshotQuery, Query()]
 ):
-    try:
-        image_data = await browser_service.take_screenshot(session_id, full_page, encoding)
+    browser_service: BrowserService = request.app.state.browser_service
+    session_manager: SessionManager = request.app.state.session_manager
+    full_page, encoding = q.full_page, q.encoding
+    image_format = browser_service.screenshot_format(q.image_format)
+    if encoding != "base64":
+        # Raw image bytes ("binary" or any non-base64 encoding): skips the base64 + JSON-escape passes.
+        screenshot_bytes = await browser_service.take_screenshot_bytes(session_id, full_page=bool(full_page), image_format=image_format, quality=q.quality)
         await session_manager.update_session_activity(session_id, "screenshot", {"full_page": full_page, "encoding": encoding})
-        logger.info(f"API: Session {session_id} took screenshot.")
-        return {"session_id": session_id, "image_data": image_data, "message": "Screenshot taken successfully."}
-    except SessionNotFoundError as e:
-        logger.warning(f"API: Screenshot attempt on non-existent session {session_id}.")
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=e.message)
-    except BrowserAutomationError as e:
-        logger.error(f"API: Failed to take screenshot for session {session_id}: {e.message}", exc_info=True)
-        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=e.message)
-
-@router.get("/sessions", summary="List all active sessions", response_model=Dict[str, Any])
+        logger.info("API: Session %s took binary screenshot.", session_id)
+        return Response(
+            content=screenshot_bytes,
+            media_type=f"image/{image_format}",
+            headers={"Content-Disposition": f"inline; filename=screenshot.{image_format}", "X-Session-Id": session_id}
+        )
+    image_data = await browser_service.take_screenshot(session_id, full_page, encoding, image_format=image_format, quality=q.quality)
+    await session_manager.update_session_activity(session_id, "screenshot", {"full_page": full_page, "encoding": encoding})
+    logger.info("API: Session %s took screenshot.", session_id)
+    return {"session_id": session_id, "image_data": image_data, "message": "Screenshot taken successfully."}
+
+@router.get("/sessions", summary="List all active sessions")
 async def list_active_sessions(
-    session_manager: SessionManager = Depends(get_session_manager)
+    request: Request
 ):
-    try:
-        active_sessions = await session_manager.get_all_sessions()
-        logger.info("API: Listed all active sessions.")
-        return {"sessions": active_sessions, "message": "Active sessions listed."}
-    except Exception as e:
-        logger.error(f"API: An unexpected error occurred while listing sessions: {e}", exc_info=True)
-        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
-
-@router.get("/session/{session_id}", summary="Get session information", response_model=Dict[str, Any])
+    session_manager: SessionManager = request.app.state.session_manager
+    active_sessions = await session_manager.get_all_sessions()
+    logger.info("API: Listed all active sessions.")
+    return {"sessions": active_sessions, "message": "Active sessions listed."}
+
+@router.get("/session/{session_id}", summary="Get session information")
 async def get_session_info(
-    session_id: str,
-    session_manager: SessionManager = Depends(get_session_manager)
+    request: Request,
+    session_id: str
 ):
-    try:
-        session_info = await session_manager.get_session_info(session_id)
-        if not session_info:
-            raise SessionNotFoundError(session_id)
-        logger.info(f"API: Retrieved info for session {session_id}.")
-        return {"session_id": session_id, "info": session_info, "message": "Session info retrieved."}
-    except SessionNotFoundError as e:
-        logger.warning(f"API: Info request for non-existent session {session_id}.")
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=e.message)
-    except Exception as e:
-        logger.error(f"API: An unexpected error occurred while getting session info: {e}", exc_info=True)
-        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
-
+    session_manager: SessionManager = request.app.state.session_manager
+    session_info = await session_manager.get_session_info(session_id)
+    if not session_info:
+        raise SessionNotFoundError(session_id)
+    logger.info("API: Retrieved info for session %s.", session_id)
+    return {"session_id": session_id, "info": session_info, "message": "Session info retrieved."}
 
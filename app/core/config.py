@@ -1,3 +1,6 @@
+from functools import lru_cache
+from typing import List
+
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 class Settings(BaseSettings):
@@ -11,6 +14,13 @@ class Settings(BaseSettings):
     SECRET_KEY: str = "super-secret-key"
     ALGORITHM: str = "HS256"
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 30
+    # Origins allowed by CORS; set explicit origins in production (JSON list in env)
+    CORS_ALLOW_ORIGINS: List[str] = ["*"]
+
+    # Server Settings (used by `python -m app.main`)
+    HOST: str = "0.0.0.0"
+    PORT: int = 8000
+    WORKERS: int = 1 # each worker runs its own browser pool; keep 1 per container
 
     # Browser Automation Settings
     MAX_BROWSER_INSTANCES: int = 2
@@ -18,6 +28,8 @@ class Settings(BaseSettings):
     MAX_CONCURRENT_SESSIONS: int = 20
     BROWSER_HEADLESS: bool = True
     BROWSER_TIMEOUT: int = 30000 # milliseconds
+    BROWSER_MAX_USES: int = 0 # contexts per browser before it is recycled; 0 = never
+    SCREENSHOT_PREFER_JPEG: bool = False # default screenshots to JPEG q80 (much smaller than PNG)
 
     # Redis Settings for Rate Limiting and Caching
     REDIS_HOST: str = "localhost"
@@ -28,6 +40,9 @@ class Settings(BaseSettings):
     LOG_LEVEL: str = "INFO"
     LOG_FILE: str = "app.log"
 
-settings = Settings()
+@lru_cache(maxsize=1)
+def get_settings() -> Settings:
+    """Build the Settings once per process; later calls return the cached instance."""
+    return Settings()
 
 
@@ -2,10 +2,15 @@ class BrowserAutomationError(Exception):
     def __init__(self, message: str, details: dict = None):
         self.message = message
         self.details = details if details is not None else {}
+        # BaseException instances always carry a __dict__, so __slots__ would save nothing;
+        # cache the payload instead since the handler and MCP wrappers both ask for it.
+        self._dict_cache = None
         super().__init__(self.message)
 
     def to_dict(self):
-        return {"message": self.message, "details": self.details}
+        if self._dict_cache is None:
+            self._dict_cache = {"message": self.message, "details": self.details}
+        return self._dict_cache
 
 class SessionNotFoundError(BrowserAutomationError):
     def __init__(self, session_id: str):
@@ -1,8 +1,18 @@
+import atexit
 import logging
-from logging.handlers import RotatingFileHandler
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 import os
+import queue
+from typing import Optional
+
+# Background listener that owns the real (blocking) handlers, and the root-logger handler
+# feeding it; see setup_logging().
+_queue_listener: Optional[QueueListener] = None
+_queue_handler: Optional[QueueHandler] = None
 
 def setup_logging():
+    global _queue_listener, _queue_handler
+
     log_level = os.getenv("LOG_LEVEL", "INFO").upper()
     log_file = os.getenv("LOG_FILE", "app.log")
 
@@ -28,7 +38,6 @@ def setup_logging():
         "%(levelname)s: %(name)s: %(message)s"
     )
     console_handler.setFormatter(console_formatter)
-    root_logger.addHandler(console_handler)
 
     # File handler with rotation
     file_handler = RotatingFileHandler(
@@ -39,9 +48,30 @@ def setup_logging():
         "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
     )
     file_handler.setFormatter(file_formatter)
-    root_logger.addHandler(file_handler)
 
-def get_logger(name: str):
-    return logging.getLogger(name)
+    # The root logger only enqueues records. QueueHandler.prepare() still formats the message
+    # (and any traceback) on the caller's thread, but stream writes and file rotation happen
+    # on the listener's thread so they never block the event loop.
+    log_queue: queue.Queue = queue.Queue(-1)
+    _queue_handler = QueueHandler(log_queue)
+    root_logger.addHandler(_queue_handler)
+    _queue_listener = QueueListener(log_queue, console_handler, file_handler, respect_handler_level=True)
+    _queue_listener.start()
+    atexit.register(shutdown_logging)
 
+def shutdown_logging():
+    """Flush queued records, stop the background logging thread and detach its queue handler.
 
+    Removing the handler lets a later setup_logging() (a second lifespan, a test client, a reload)
+    install a fresh listener instead of enqueueing into a queue nothing drains.
+    """
+    global _queue_listener, _queue_handler
+    if _queue_handler is not None:
+        logging.getLogger().removeHandler(_queue_handler)
+        _queue_handler = None
+    if _queue_listener is not None:
+        _queue_listener.stop()
+        _queue_listener = None
+
+def get_logger(name: str):
+    return logging.getLogger(name)
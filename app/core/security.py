@@ -1,9 +1,10 @@
 import jwt
 from datetime import datetime, timedelta
 from typing import Optional
-from app.core.config import settings
+from app.core.config import get_settings
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
+    settings = get_settings()
     to_encode = data.copy()
     if expires_delta:
         expire = datetime.utcnow() + expires_delta
@@ -14,6 +15,7 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     return encoded_jwt
 
 def verify_token(token: str):
+    settings = get_settings()
     try:
         payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
         return payload
@@ -1,8 +1,16 @@
+import functools
+import logging
+from contextlib import asynccontextmanager
+from typing import Dict, Tuple, Type
+
+import httpx
+import orjson
 from fastapi import FastAPI, Request, HTTPException, status
-from fastapi.responses import JSONResponse
+from fastapi.responses import Response
 from fastapi.middleware.cors import CORSMiddleware
-from app.core.config import settings
-from app.core.logging import setup_logging, get_logger
+from app.core.config import get_settings
+from app.core.logging import setup_logging, shutdown_logging, get_logger
+from app.core.responses import ORJSONResponse
 from app.core.exceptions import (
     BrowserAutomationError,
     SessionNotFoundError,
@@ -24,35 +32,77 @@ from app.api.endpoints import browser
 setup_logging()
 logger = get_logger(__name__)
 
+settings = get_settings()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    logger.info("FastAPI application startup.")
+    # App-wide service singletons live on app.state; endpoints read them directly
+    # from request.app.state rather than resolving a dependency on every request.
+    app.state.browser_service = BrowserService(
+        max_browsers=settings.MAX_BROWSER_INSTANCES,
+        max_contexts_per_browser=settings.MAX_CONTEXTS_PER_BROWSER,
+        headless=settings.BROWSER_HEADLESS,
+        timeout=settings.BROWSER_TIMEOUT,
+        max_sessions=settings.MAX_CONCURRENT_SESSIONS,
+        max_uses_per_browser=settings.BROWSER_MAX_USES or None,
+        prefer_jpeg=settings.SCREENSHOT_PREFER_JPEG
+    )
+    # Idle-session expiry closes the browser session too, keeping both services in step
+    app.state.session_manager = SessionManager(on_expire=app.state.browser_service.close_session)
+    # ...and an LRU-evicted browser session drops its registration
+    app.state.browser_service.on_evict = functools.partial(app.state.session_manager.unregister_session, missing_ok=True)
+    app.state.session_manager.start_cleanup_task()
+    # One pooled HTTP client for any outbound calls (webhooks, exporters). Reuse it from
+    # request.app.state.http_client; never construct an AsyncClient per request.
+    app.state.http_client = httpx.AsyncClient(
+        timeout=5.0,
+        limits=httpx.Limits(max_connections=100, max_keepalive_connections=20)
+    )
+    # Start Playwright and pre-launch browsers so the first create_session doesn't pay the cold start.
+    try:
+        await app.state.browser_service.start()
+    except BrowserAutomationError as e:
+        logger.warning("Browser warm-up failed; browsers will be launched on demand: %s", e.message)
+    yield
+    logger.info("FastAPI application shutdown.")
+    await app.state.http_client.aclose()
+    app.state.session_manager.stop_cleanup_task()
+    await app.state.browser_service.close_all_browsers()
+    shutdown_logging()
+
 app = FastAPI(
     title=settings.APP_NAME,
     version=settings.APP_VERSION,
     description="Browser Automation MCP Server with FastAPI",
     docs_url="/docs",
     redoc_url="/redoc",
-    openapi_url="/openapi.json"
+    openapi_url="/openapi.json",
+    default_response_class=ORJSONResponse,
+    lifespan=lifespan
 )
 
-# CORS Middleware
+# Probe endpoints (k8s liveness/readiness, uptime checks) never need CORS headers.
+_CORS_EXEMPT_PATHS = frozenset({"/", "/health"})
+
+class ProbeExemptCORSMiddleware(CORSMiddleware):
+    """CORSMiddleware that hands probe endpoints straight to the app without CORS processing."""
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["path"] in _CORS_EXEMPT_PATHS:
+            await self.app(scope, receive, send)
+            return
+        await super().__call__(scope, receive, send)
+
+# CORS Middleware; a frozenset makes the per-request origin check a hash lookup
 app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],  # Adjust this to your frontend origin in production
+    ProbeExemptCORSMiddleware,
+    allow_origins=frozenset(settings.CORS_ALLOW_ORIGINS),
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
 )
 
-# Initialize services (can be done via dependency injection in a larger app)
-# For simplicity, we'll initialize them globally here for now
-# These should ideally be managed as singletons or dependencies
-app.browser_service = BrowserService(
-    max_browsers=settings.MAX_BROWSER_INSTANCES,
-    max_contexts_per_browser=settings.MAX_CONTEXTS_PER_BROWSER,
-    headless=settings.BROWSER_HEADLESS,
-    timeout=settings.BROWSER_TIMEOUT
-)
-app.session_manager = SessionManager()
-
 # Include API routers
 app.include_router(browser.router, prefix="/browser", tags=["Browser Automation"])
 
@@ -69,8 +119,8 @@ async def health_check():
 # Global Exception Handler
 @app.exception_handler(HTTPException)
 async def http_exception_handler(request: Request, exc: HTTPException):
-    logger.error(f"HTTP Exception: {exc.status_code} - {exc.detail}", exc_info=True)
-    return JSONResponse(
+    logger.error("HTTP Exception: %s - %s", exc.status_code, exc.detail, exc_info=True)
+    return ORJSONResponse(
         status_code=exc.status_code,
         content={
             "message": exc.detail,
@@ -79,157 +129,62 @@ async def http_exception_handler(request: Request, exc: HTTPException):
         }
     )
 
+# Status code, error code and log level for each BrowserAutomationError subclass.
+# A single handler dispatches over this table; lookups follow the exception's MRO so
+# unlisted subclasses inherit the mapping of their nearest listed ancestor.
+_EXC_TABLE: Dict[Type[BrowserAutomationError], Tuple[int, str, int]] = {
+    BrowserAutomationError: (status.HTTP_500_INTERNAL_SERVER_ERROR, "BROWSER_AUTOMATION_ERROR", logging.ERROR),
+    SessionNotFoundError: (status.HTTP_404_NOT_FOUND, "SESSION_NOT_FOUND", logging.WARNING),
+    NavigationError: (status.HTTP_500_INTERNAL_SERVER_ERROR, "NAVIGATION_ERROR", logging.ERROR),
+    ElementError: (status.HTTP_500_INTERNAL_SERVER_ERROR, "ELEMENT_ERROR", logging.ERROR),
+    InvalidURLError: (status.HTTP_400_BAD_REQUEST, "INVALID_URL_ERROR", logging.ERROR),
+    ElementNotFoundError: (status.HTTP_404_NOT_FOUND, "ELEMENT_NOT_FOUND", logging.WARNING),
+    ElementNotInteractableError: (status.HTTP_400_BAD_REQUEST, "ELEMENT_NOT_INTERACTABLE", logging.WARNING),
+    InvalidSelectorError: (status.HTTP_400_BAD_REQUEST, "INVALID_SELECTOR", logging.WARNING),
+    MCPError: (status.HTTP_500_INTERNAL_SERVER_ERROR, "MCP_ERROR", logging.ERROR),
+    ToolNotFoundError: (status.HTTP_404_NOT_FOUND, "TOOL_NOT_FOUND", logging.WARNING),
+    InvalidToolArgumentsError: (status.HTTP_400_BAD_REQUEST, "INVALID_TOOL_ARGUMENTS", logging.WARNING),
+}
+
+# The constant part of each error body, serialised once: only message and details vary
+# per exception, so the handler splices those two onto a pre-built prefix.
+_EXC_BODY_PREFIX: Dict[str, bytes] = {
+    code: b'{"status":"error","code":' + orjson.dumps(code) + b',"message":'
+    for _, code, _ in _EXC_TABLE.values()
+}
+
+def _lookup_exc(exc_type: type) -> Tuple[int, str, int]:
+    for klass in exc_type.__mro__:
+        entry = _EXC_TABLE.get(klass)
+        if entry is not None:
+            return entry
+    return _EXC_TABLE[BrowserAutomationError]
+
 @app.exception_handler(BrowserAutomationError)
 async def browser_automation_exception_handler(request: Request, exc: BrowserAutomationError):
-    logger.error(f"Browser Automation Error: {exc.message}", exc_info=True)
-    return JSONResponse(
-        status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-        content={
-            "message": exc.message,
-            "status": "error",
-            "code": "BROWSER_AUTOMATION_ERROR",
-            "details": exc.to_dict()
-        }
-    )
-
-@app.exception_handler(SessionNotFoundError)
-async def session_not_found_exception_handler(request: Request, exc: SessionNotFoundError):
-    logger.warning(f"Session Not Found Error: {exc.message}", exc_info=True)
-    return JSONResponse(
-        status_code=status.HTTP_404_NOT_FOUND,
-        content={
-            "message": exc.message,
-            "status": "error",
-            "code": "SESSION_NOT_FOUND",
-            "details": exc.to_dict()
-        }
-    )
-
-@app.exception_handler(NavigationError)
-async def navigation_error_handler(request: Request, exc: NavigationError):
-    logger.error(f"Navigation Error: {exc.message}", exc_info=True)
-    return JSONResponse(
-        status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-        content={
-            "message": exc.message,
-            "status": "error",
-            "code": "NAVIGATION_ERROR",
-            "details": exc.to_dict()
-        }
-    )
-
-@app.exception_handler(ElementError)
-async def element_error_handler(request: Request, exc: ElementError):
-    logger.error(f"Element Error: {exc.message}", exc_info=True)
-    return JSONResponse(
-        status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-        content={
-            "message": exc.message,
-            "status": "error",
-            "code": "ELEMENT_ERROR",
-            "details": exc.to_dict()
-        }
-    )
-
-@app.exception_handler(InvalidURLError)
-async def invalid_url_error_handler(request: Request, exc: InvalidURLError):
-    logger.error(f"Invalid URL Error: {exc.message}", exc_info=True)
-    return JSONResponse(
-        status_code=status.HTTP_400_BAD_REQUEST,
-        content={
-            "message": exc.message,
-            "status": "error",
-            "code": "INVALID_URL_ERROR",
-            "details": exc.to_dict()
-        }
+    status_code, code, level = _lookup_exc(type(exc))
+    # Client misses (unknown session, element not found, bad selector) log at WARNING and are
+    # routine; only server-side failures pay for formatting a traceback.
+    logger.log(level, "%s: %s", type(exc).__name__, exc.message, exc_info=level >= logging.ERROR)
+    body = b"".join((
+        _EXC_BODY_PREFIX[code],
+        orjson.dumps(exc.message),
+        b',"details":',
+        orjson.dumps(exc.to_dict(), option=orjson.OPT_NON_STR_KEYS),
+        b"}",
+    ))
+    return Response(content=body, status_code=status_code, media_type="application/json")
+
+if __name__ == "__main__":
+    import sys
+    import uvicorn
+
+    # uvloop has no Windows build; fall back to the stdlib asyncio loop there.
+    uvicorn.run(
+        "app.main:app",
+        host=settings.HOST,
+        port=settings.PORT,
+        workers=settings.WORKERS,
+        loop="asyncio" if sys.platform == "win32" else "uvloop",
+        http="httptools"
     )
-
-@app.exception_handler(ElementNotFoundError)
-async def element_not_found_error_handler(request: Request, exc: ElementNotFoundError):
-    logger.warning(f"Element Not Found Error: {exc.message}", exc_info=True)
-    return JSONResponse(
-        status_code=status.HTTP_404_NOT_FOUND,
-        content={
-            "message": exc.message,
-            "status": "error",
-            "code": "ELEMENT_NOT_FOUND",
-            "details": exc.to_dict()
-        }
-    )
-
-@app.exception_handler(ElementNotInteractableError)
-async def element_not_interactable_error_handler(request: Request, exc: ElementNotInteractableError):
-    logger.warning(f"Element Not Interactable Error: {exc.message}", exc_info=True)
-    return JSONResponse(
-        status_code=status.HTTP_400_BAD_REQUEST,
-        content={
-            "message": exc.message,
-            "status": "error",
-            "code": "ELEMENT_NOT_INTERACTABLE",
-            "details": exc.to_dict()
-        }
-    )
-
-@app.exception_handler(InvalidSelectorError)
-async def invalid_selector_error_handler(request: Request, exc: InvalidSelectorError):
-    logger.warning(f"Invalid Selector Error: {exc.message}", exc_info=True)
-    return JSONResponse(
-        status_code=status.HTTP_400_BAD_REQUEST,
-        content={
-            "message": exc.message,
-            "status": "error",
-            "code": "INVALID_SELECTOR",
-            "details": exc.to_dict()
-        }
-    )
-
-@app.exception_handler(MCPError)
-async def mcp_error_handler(request: Request, exc: MCPError):
-    logger.error(f"MCP Error: {exc.message}", exc_info=True)
-    return JSONResponse(
-        status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-        content={
-            "message": exc.message,
-            "status": "error",
-            "code": "MCP_ERROR",
-            "details": exc.details
-        }
-    )
-
-@app.exception_handler(ToolNotFoundError)
-async def tool_not_found_error_handler(request: Request, exc: ToolNotFoundError):
-    logger.warning(f"Tool Not Found Error: {exc.message}", exc_info=True)
-    return JSONResponse(
-        status_code=status.HTTP_404_NOT_FOUND,
-        content={
-            "message": exc.message,
-            "status": "error",
-            "code": "TOOL_NOT_FOUND",
-            "details": exc.to_dict()
-        }
-    )
-
-@app.exception_handler(InvalidToolArgumentsError)
-async def invalid_tool_arguments_error_handler(request: Request, exc: InvalidToolArgumentsError):
-    logger.warning(f"Invalid Tool Arguments Error: {exc.message}", exc_info=True)
-    return JSONResponse(
-        status_code=status.HTTP_400_BAD_REQUEST,
-        content={
-            "message": exc.message,
-            "status": "error",
-            "code": "INVALID_TOOL_ARGUMENTS",
-            "details": exc.to_dict()
-        }
-    )
-
-@app.on_event("startup")
-async def startup_event():
-    logger.info("FastAPI application startup event.")
-    # Perform any startup tasks here, e.g., initializing browser service pools
-
-@app.on_event("shutdown")
-async def shutdown_event():
-    logger.info("FastAPI application shutdown event.")
-    # Perform any shutdown tasks here, e.g., closing browser instances
-    await app.browser_service.close_all_browsers()
-
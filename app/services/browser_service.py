@@ -1,6 +1,17 @@
 from playwright.async_api import async_playwright, Browser, Page, BrowserContext
-from typing import Dict, Any, Optional, Set, List
+from playwright.async_api import Error as PlaywrightError, TimeoutError as PlaywrightTimeoutError
+from typing import Dict, Any, Optional, Set, FrozenSet, List, Deque, AsyncIterator, Union, Tuple, Sequence, Callable, Awaitable
 import asyncio
+import base64
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager, nullcontext, suppress
+import functools
+import hashlib
+from io import BytesIO
+from dataclasses import dataclass, field
+import logging
+from operator import itemgetter
+from urllib.parse import urlsplit
 from uuid import uuid4
 from app.core.logging import get_logger
 from app.core.exceptions import (
@@ -49,7 +60,7 @@ CLICKABLE_SELECTOR = ",".join(
     ]
 )
 
-CLICKABLE_ROLE_HINTS: Set[str] = {
+CLICKABLE_ROLE_HINTS: FrozenSet[str] = frozenset({
     "button",
     "link",
     "menuitem",
@@ -65,76 +76,710 @@ CLICKABLE_ROLE_HINTS: Set[str] = {
     "row",
     "combobox",
     "listitem",
-}
+})
+
+# Roles kept by get_accessibility_tree(compact=True): interactive controls plus the landmarks
+# and headings an agent needs to orient itself.
+AX_COMPACT_ROLES: FrozenSet[str] = frozenset({
+    "button",
+    "link",
+    "textbox",
+    "searchbox",
+    "heading",
+    "checkbox",
+    "radio",
+    "switch",
+    "combobox",
+    "listbox",
+    "option",
+    "menuitem",
+    "menuitemcheckbox",
+    "menuitemradio",
+    "tab",
+    "slider",
+    "spinbutton",
+    "img",
+    "dialog",
+    "alert",
+    "navigation",
+    "main",
+    "form",
+    "search",
+})
+
+# Form controls whose descendants are only their own text: when such a node fails the role or name
+# filter, get_accessibility_tree(prune_leaves=True) doesn't descend into it. Buttons, links, headings
+# and images are left out on purpose; they routinely contain links, images and named text.
+_AX_LEAF_ROLES: FrozenSet[str] = frozenset({"textbox", "checkbox", "radio"})
+
+# Layout-only roles: with no name or value they carry nothing but their children.
+_AX_WRAPPER_ROLES: FrozenSet[str] = frozenset({"generic", "none", "presentation", "ignored"})
+
+# Sort key for find_click_targets records: highest confidence first, then page order.
+_BY_SORT_KEY = itemgetter("_sort_key")
+
+# Tags that earn a small bonus when scoring find_click_targets matches.
+_CLICK_BONUS_TAGS: FrozenSet[str] = frozenset({"button", "a", "input", "ytmusic-responsive-list-item-renderer"})
+
+# Flags for Playwright-managed Chromium: shed subsystems headless automation never uses
+# (GPU process, extensions, sync, background networking) to cut startup time and RSS.
+# --no-zygote relies on the sandbox being off, hence chromium_sandbox=False at launch.
+CHROMIUM_ARGS: Tuple[str, ...] = (
+    "--disable-gpu",
+    "--disable-dev-shm-usage",
+    "--disable-extensions",
+    "--disable-background-networking",
+    "--disable-sync",
+    "--disable-default-apps",
+    "--no-first-run",
+    "--no-zygote",
+    "--disable-features=TranslateUI",
+)
+
+# URL schemes navigate() accepts; http(s) URLs must also name a host. Anything else is
+# rejected before a browser round-trip.
+NAVIGABLE_SCHEMES = frozenset({"http", "https", "file", "about"})
+_HOST_SCHEMES = frozenset({"http", "https"})
+
+_b64encode = base64.b64encode
+
+# Screenshot quality used when a lossy format is requested without one. Against PNG, JPEG at 80 is
+# typically 5-10x smaller on ordinary pages (less to move over CDP, base64 and the LLM link) at
+# the cost of soft edges on small text; WebP is a further 25-35% smaller at similar quality.
+SCREENSHOT_JPEG_QUALITY = 80
+SCREENSHOT_WEBP_QUALITY = 75
+SCREENSHOT_FORMATS: FrozenSet[str] = frozenset({"png", "jpeg", "webp"})
+
+def _png_to_webp(data: bytes, quality: int) -> bytes:
+    """Re-encode a PNG capture as WebP (Chromium's screenshot API has no WebP output). Needs Pillow."""
+    try:
+        from PIL import Image
+    except ImportError:
+        raise BrowserAutomationError("WebP screenshots require Pillow (pip install pillow).") from None
+    out = BytesIO()
+    with Image.open(BytesIO(data)) as image:
+        image.save(out, "WEBP", quality=quality)
+    return out.getvalue()
+
+# Browsers tried by launch_chrome_with_cdp when no exe_path is given: Chrome, then Edge (Windows installs)
+CDP_BROWSER_CANDIDATES: Tuple[str, ...] = (
+    r"C:\\Program Files\\Google\\Chrome\\Application\\chrome.exe",
+    r"C:\\Program Files (x86)\\Google\\Chrome\\Application\\chrome.exe",
+    r"C:\\Program Files (x86)\\Microsoft\\Edge\\Application\\msedge.exe",
+    r"C:\\Program Files\\Microsoft\\Edge\\Application\\msedge.exe",
+)
+
+# exe_path -> the install path _resolve_browser_exe found for it. Only hits are stored, so a
+# browser installed after a failed lookup is still picked up on the next launch.
+_resolved_browser_exes: Dict[Optional[str], str] = {}
+
+def _resolve_browser_exe(exe_path: Optional[str]) -> str:
+    """First existing candidate for exe_path (or CDP_BROWSER_CANDIDATES), else fall back to PATH.
+
+    Successful lookups are cached so repeated launches don't stat the install paths again.
+    """
+    resolved = _resolved_browser_exes.get(exe_path)
+    if resolved is not None:
+        return resolved
+    for path in (exe_path,) if exe_path else CDP_BROWSER_CANDIDATES:
+        if os.path.isfile(path):
+            _resolved_browser_exes[exe_path] = path
+            return path
+    return exe_path or "chrome.exe"
+
+def _digest_and_encode(data: bytes, cached: Optional[Tuple[bytes, str]]) -> Tuple[bytes, str]:
+    """Hash a capture and base64-encode it, reusing cached's string when the bytes are identical."""
+    digest = hashlib.sha256(data).digest()
+    if cached is not None and cached[0] == digest:
+        return cached
+    return digest, _b64encode(data).decode("ascii")
+
+# Size (in characters) of the slices yielded by aiter_text_chunks when streaming page content.
+CONTENT_CHUNK_SIZE = 64 * 1024
+
+async def aiter_text_chunks(text: str, chunk_size: int = CONTENT_CHUNK_SIZE) -> AsyncIterator[bytes]:
+    """Yield UTF-8 encoded slices of text so large documents can be streamed without building one encoded copy.
+
+    Async so StreamingResponse iterates it on the event loop; a sync iterator would cost a
+    threadpool hop per chunk for text that is already in memory.
+    """
+    for start in range(0, len(text), chunk_size):
+        yield text[start:start + chunk_size].encode("utf-8")
+
+# Upper bound (in characters, summed over sessions) on page HTML kept by get_page_content's cache.
+CONTENT_CACHE_MAX_CHARS = 32 * 1024 * 1024
+
+# Init script added to every session page: counts DOM mutations (script-driven updates, XHR
+# rendering, hydration) so cached snapshots can tell whether the document changed under them.
+_DOM_WATCH_SCRIPT = """
+(() => {
+    if (window.__browserMcpDomGen !== undefined) {
+        return;
+    }
+    window.__browserMcpDomGen = 0;
+    new MutationObserver(() => { window.__browserMcpDomGen++; }).observe(document, {
+        subtree: true,
+        childList: true,
+        attributes: true,
+        characterData: true,
+    });
+})();
+"""
+
+# Current mutation count, or -1 when the document predates the watch script (never cache then)
+_DOM_GENERATION_JS = "() => window.__browserMcpDomGen ?? -1"
+
+@dataclass(slots=True)
+class SessionRecord:
+    """Everything the service tracks for one session, held in a single map entry."""
+
+    session_id: str
+    page: Page
+    context: BrowserContext
+    # Pooled browser key the session occupies a slot on; None for CDP sessions
+    browser_key: Optional[int] = None
+    # Connected via CDP to a user-managed browser; its context must not be closed
+    cdp: bool = False
+    # Caller-chosen key when the context is shared with other sessions
+    context_id: Optional[str] = None
+    # Default timeout (ms) for this session's operations, resolved once at creation
+    timeout: int = 30000
+    # Bumped by every action that can change the DOM and by every main-frame navigation (including
+    # ones the page or user triggers itself); cached content/AX snapshots are only reused while it matches
+    version: int = 0
+    # Main-frame URL as of the last navigation event, so hot paths read a plain str
+    url: str = ""
+    # Serialises this session's page actions (navigate/click/type/press/click_by_text and chain)
+    lock: asyncio.Lock = field(default_factory=asyncio.Lock, repr=False)
+    # Profile directory when the session runs in a persistent context shared per directory
+    user_data_dir: Optional[str] = None
+
+def _log_exc(msg: str, *args: Any):
+    """Log a failure from inside an except block; the traceback is only formatted when DEBUG is enabled."""
+    if logger.isEnabledFor(logging.ERROR):
+        logger.error(msg, *args, exc_info=logger.isEnabledFor(logging.DEBUG))
+
+def _log_refill_failure(task: "asyncio.Task"):
+    """Done callback for background warm-pool refills; warmup() has already logged the details."""
+    if not task.cancelled() and task.exception() is not None:
+        logger.warning("Background browser refill failed: %s", task.exception())
+
+def requires_session(fn):
+    """Resolve the session_id argument to its SessionRecord (one dict lookup) or raise SessionNotFoundError."""
+    @functools.wraps(fn)
+    async def wrapper(self, session_id: str, *args, **kwargs):
+        return await fn(self, self._get_session(session_id), *args, **kwargs)
+    return wrapper
+
+def _classify_element_error(selector: str, e: Exception) -> ElementError:
+    """Map a Playwright failure from a selector action onto the matching ElementError subclass."""
+    if isinstance(e, PlaywrightTimeoutError):
+        # Actions retry until the timeout; the call log notes when a resolved element was not actionable
+        if "element is not" in e.message:
+            return ElementNotInteractableError(selector)
+        return ElementNotFoundError(selector)
+    if isinstance(e, PlaywrightError):
+        message = e.message
+        if "while parsing selector" in message or "is not a valid selector" in message:
+            return InvalidSelectorError(selector)
+        if "not attached to the DOM" in message:
+            return ElementNotFoundError(selector)
+    return ElementError(selector, message=str(e))
+
+def _classify_navigation_error(url: str, e: Exception) -> BrowserAutomationError:
+    """Map a page.goto failure onto InvalidURLError or NavigationError."""
+    if isinstance(e, PlaywrightError):
+        message = e.message
+        # Timeouts never carry a net:: error code, so only other Playwright errors need the check
+        if not isinstance(e, PlaywrightTimeoutError) and "ERR_INVALID_URL" in message:
+            return InvalidURLError(url)
+        return NavigationError(url, message=message)
+    return NavigationError(url, message=str(e))
 
 class BrowserService:
-    def __init__(self, max_browsers: int = 1, max_contexts_per_browser: int = 5, headless: bool = True, timeout: int = 30000):
+    # Fixed attribute set: no per-instance __dict__, and attribute typos fail loudly
+    __slots__ = (
+        "max_browsers",
+        "max_sessions",
+        "on_evict",
+        "max_contexts_per_browser",
+        "headless",
+        "timeout",
+        "launch_args",
+        "browsers",
+        "_next_browser_id",
+        "_cdp_browsers",
+        "sessions",
+        "playwright_instance",
+        "_launchers",
+        "_ctx_counts",
+        "_free_browsers",
+        "_free_list_of",
+        "_browser_sema",
+        "_shared_contexts",
+        "_context_refs",
+        "_persistent_contexts",
+        "_persistent_refs",
+        "_warm_pool_size",
+        "max_uses_per_browser",
+        "_browser_uses",
+        "_retiring",
+        "_capacity_freed",
+        "_refill_task",
+        "prefer_jpeg",
+        "_content_cache",
+        "_content_cache_chars",
+        "_ax_cache",
+        "_shot_cache",
+    )
+
+    def __init__(self, max_browsers: int = 1, max_contexts_per_browser: int = 5, headless: bool = True, timeout: int = 30000, launch_args: Optional[List[str]] = None, max_sessions: Optional[int] = None, max_uses_per_browser: Optional[int] = None, prefer_jpeg: bool = False, on_evict: Optional[Callable[[str], Awaitable[Any]]] = None):
         self.max_browsers = max_browsers
+        # Cap on open sessions (CDP ones included); creating one past it closes the least recently
+        # used pooled session (None = unbounded)
+        self.max_sessions = max_sessions
+        # Awaited with the session_id after an LRU eviction (SessionManager.unregister_session in the
+        # apps) so the registration goes with the browser session
+        self.on_evict = on_evict
         self.max_contexts_per_browser = max_contexts_per_browser
         self.headless = headless
         self.timeout = timeout
-        self.browsers = {}
-        self.contexts = {}
-        self.pages = {}
+        # Screenshot format when the caller doesn't name one: JPEG instead of PNG (see SCREENSHOT_JPEG_QUALITY)
+        self.prefer_jpeg = prefer_jpeg
+        # Extra command-line flags for launched Chromium; defaults to CHROMIUM_ARGS
+        self.launch_args = list(CHROMIUM_ARGS if launch_args is None else launch_args)
+        # Pooled (Playwright-launched) browsers keyed by a monotonically increasing int id
+        self.browsers: Dict[int, Browser] = {}
+        self._next_browser_id = 0
+        # Browsers reached over CDP; user-managed, so never pooled or counted against max_browsers
+        self._cdp_browsers: List[Browser] = []
+        # Least recently used first: every lookup through _get_session moves the entry to the end
+        self.sessions: "OrderedDict[str, SessionRecord]" = OrderedDict()
         self.playwright_instance = None
-        self._browser_counter = 0
-        # Track sessions connected via CDP to a user-managed browser (visible)
-        self._cdp_sessions = set()
+        # browser_type -> BrowserType, filled once Playwright has started
+        self._launchers: Dict[str, Any] = {}
+        # Open contexts per pooled browser key, mirrored locally so acquiring a browser
+        # never has to ask Playwright for browser.contexts
+        self._ctx_counts: Dict[int, int] = {}
+        # Browser keys with spare context capacity per (browser_type, headless) bucket; the left
+        # end is filled first. _free_list_of maps each pooled key to its bucket's deque.
+        self._free_browsers: Dict[Tuple[str, bool], Deque[int]] = {}
+        self._free_list_of: Dict[int, Deque[int]] = {}
+        # Per-browser admission control for page operations, sized to max_contexts_per_browser
+        self._browser_sema: Dict[int, asyncio.Semaphore] = {}
+        # Opt-in shared contexts: context_id -> (context, browser_key) and the number of sessions using each
+        self._shared_contexts: Dict[str, Tuple[BrowserContext, int]] = {}
+        self._context_refs: Dict[str, int] = {}
+        # Persistent contexts: user_data_dir -> launch task (one browser per profile directory,
+        # outside the pool) and the number of sessions using each
+        self._persistent_contexts: Dict[str, "asyncio.Task[BrowserContext]"] = {}
+        self._persistent_refs: Dict[str, int] = {}
+        # Number of idle browsers warmup() asked to keep alive between sessions
+        self._warm_pool_size = 0
+        # Contexts a pooled browser may host over its lifetime before it is retired (None = no limit).
+        # Retired browsers take no new contexts and close once empty; the warm pool is refilled in the background.
+        self.max_uses_per_browser = max_uses_per_browser
+        self._browser_uses: Dict[int, int] = {}
+        self._retiring: Set[int] = set()
+        self._refill_task: Optional[asyncio.Task] = None
+        # Set (and replaced) whenever a pooled slot frees up; create_session waits on it when the pool is full
+        self._capacity_freed = asyncio.Event()
+        # session_id -> (version, url, DOM generation, html) of the last full-page get_page_content,
+        # least recently used first
+        self._content_cache: "OrderedDict[str, Tuple[int, str, int, str]]" = OrderedDict()
+        self._content_cache_chars = 0
+        # session_id -> (version, interesting_only, DOM generation, snapshot) of the last raw accessibility snapshot
+        self._ax_cache: Dict[str, Tuple[int, bool, int, Optional[Dict[str, Any]]]] = {}
+        # session_id -> (sha256 digest, base64 string) of the last base64 screenshot
+        self._shot_cache: Dict[str, Tuple[bytes, str]] = {}
+
+    def _get_session(self, session_id: str) -> SessionRecord:
+        rec = self.sessions.get(session_id)
+        if rec is None:
+            raise SessionNotFoundError(session_id)
+        self.sessions.move_to_end(session_id)
+        return rec
+
+    async def _track_navigation(self, rec: SessionRecord):
+        page = rec.page
+        rec.url = page.url
+        # Without the watch script the page's documents just never serve cached content
+        with suppress(PlaywrightError):
+            await page.add_init_script(_DOM_WATCH_SCRIPT)
+
+        def on_frame_navigated(frame):
+            if frame is page.main_frame:
+                rec.url = frame.url
+                rec.version += 1
+
+        page.on("framenavigated", on_frame_navigated)
+
+    async def _evict_idle_sessions(self, keep: int):
+        # Close least recently used sessions until at most `keep` remain. CDP sessions count toward
+        # the total but are never evicted, nor is a session whose lock a tool call is holding.
+        excess = len(self.sessions) - keep
+        if excess <= 0:
+            return
+        victims = [rec for rec in self.sessions.values() if not rec.cdp and not rec.lock.locked()][:excess]
+        for rec in victims:
+            sid = rec.session_id
+            # Re-checked after each await: a victim may have been closed or picked up meanwhile
+            if sid not in self.sessions or rec.lock.locked():
+                continue
+            logger.info(f"Evicting least recently used session {sid} (max_sessions={self.max_sessions})")
+            await self.close_session(sid)
+            if self.on_evict is not None:
+                try:
+                    await self.on_evict(sid)
+                except Exception as e:
+                    logger.warning("Error unregistering evicted session %s: %s", sid, e)
 
-    async def _launch_browser(self, browser_type: str = "chromium", headless: Optional[bool] = None) -> Browser:
+    async def _ensure_playwright(self):
         if not self.playwright_instance:
             self.playwright_instance = await async_playwright().start()
+            pw = self.playwright_instance
+            self._launchers = {"chromium": pw.chromium, "firefox": pw.firefox, "webkit": pw.webkit}
+
+    async def _launch_browser(self, browser_type: str = "chromium", headless: Optional[bool] = None) -> Browser:
+        await self._ensure_playwright()
+        launcher = self._launchers.get(browser_type)
+        if launcher is None:
+            raise BrowserAutomationError(f"Unsupported browser type: {browser_type}")
 
         effective_headless = self.headless if headless is None else headless
         if browser_type == "chromium":
-            browser = await self.playwright_instance.chromium.launch(headless=effective_headless)
-        elif browser_type == "firefox":
-            browser = await self.playwright_instance.firefox.launch(headless=effective_headless)
-        elif browser_type == "webkit":
-            browser = await self.playwright_instance.webkit.launch(headless=effective_headless)
+            browser = await launcher.launch(headless=effective_headless, args=self.launch_args, chromium_sandbox=False)
         else:
-            raise BrowserAutomationError(f"Unsupported browser type: {browser_type}")
-        self._browser_counter += 1
-        logger.info(f"Launched new {browser_type} browser. Total browsers: {self._browser_counter}")
+            browser = await launcher.launch(headless=effective_headless)
+        logger.info(f"Launched new {browser_type} browser.")
         return browser
 
-    async def create_session(self, session_id: Optional[str] = None, browser_type: str = "chromium", headless: Optional[bool] = None, viewport_width: Optional[int] = None, viewport_height: Optional[int] = None) -> Dict[str, Any]:
+    async def start(self, warm_browsers: Optional[int] = None) -> int:
+        """Start Playwright and pre-launch warm_browsers Chromium browsers (default max_browsers).
+
+        Call once at application startup so neither the driver start nor a browser launch lands
+        on the first request. Returns the number of browsers launched; operations still start
+        Playwright lazily if this was never called.
+        """
+        try:
+            await self._ensure_playwright()
+        except Exception as e:
+            _log_exc("Error starting Playwright: %s", e)
+            raise BrowserAutomationError(f"Failed to start Playwright: {e}")
+        return await self.warmup(warm_browsers)
+
+    async def __aenter__(self) -> "BrowserService":
+        await self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close_all_browsers()
+
+    def _add_pooled_browser(self, browser: Browser, bucket: Tuple[str, bool]) -> int:
+        browser_key = self._next_browser_id
+        self._next_browser_id += 1
+        self.browsers[browser_key] = browser
+        logger.info(f"Added {bucket[0]} browser {browser_key} (headless={bucket[1]}) to the pool. Total browsers: {len(self.browsers)}")
+        self._ctx_counts[browser_key] = 0
+        self._browser_sema[browser_key] = asyncio.Semaphore(self.max_contexts_per_browser)
+        free = self._free_browsers.setdefault(bucket, deque())
+        free.append(browser_key)
+        self._free_list_of[browser_key] = free
+        return browser_key
+
+    def _gate(self, rec: SessionRecord):
+        # CDP sessions run on a user-managed browser outside the pool and are not throttled
+        sema = self._browser_sema.get(rec.browser_key)
+        return sema if sema is not None else nullcontext()
+
+    def _acquire_slot(self, browser_key: int):
+        # Caller has already popped browser_key off its bucket's free list
+        count = self._ctx_counts[browser_key] + 1
+        self._ctx_counts[browser_key] = count
+        if self.max_uses_per_browser:
+            uses = self._browser_uses.get(browser_key, 0) + 1
+            self._browser_uses[browser_key] = uses
+            if uses >= self.max_uses_per_browser:
+                # Used up: leave it off the free list so it drains and gets closed
+                self._retiring.add(browser_key)
+                return
+        if count < self.max_contexts_per_browser:
+            self._free_list_of[browser_key].appendleft(browser_key)
+
+    def _release_slot(self, browser_key: int) -> int:
+        count = self._ctx_counts[browser_key] - 1
+        self._ctx_counts[browser_key] = count
+        if count == self.max_contexts_per_browser - 1 and browser_key not in self._retiring:
+            self._free_list_of[browser_key].append(browser_key)
+        self._signal_capacity()
+        return count
+
+    def _signal_capacity(self):
+        # Wake every create_session waiting for a slot; each re-checks the pool itself
+        self._capacity_freed.set()
+        self._capacity_freed = asyncio.Event()
+
+    async def _wait_for_capacity(self, deadline: float):
+        freed = self._capacity_freed
+        remaining = deadline - asyncio.get_running_loop().time()
+        try:
+            if remaining <= 0:
+                raise asyncio.TimeoutError
+            await asyncio.wait_for(freed.wait(), remaining)
+        except asyncio.TimeoutError:
+            raise BrowserAutomationError("Maximum number of browser instances reached.") from None
+
+    async def _close_pooled_browser(self, browser_key: int):
+        browser = self.browsers.pop(browser_key)
+        self._ctx_counts.pop(browser_key, None)
+        self._browser_sema.pop(browser_key, None)
+        self._browser_uses.pop(browser_key, None)
+        self._retiring.discard(browser_key)
+        free = self._free_list_of.pop(browser_key)
+        if browser_key in free:
+            free.remove(browser_key)
+        self._signal_capacity()
+        await browser.close()
+        logger.info(f"Closed browser {browser_key}. Total browsers: {len(self.browsers)}")
+
+    async def _close_idle_browser(self) -> bool:
+        # At the browser cap: make room by closing a browser no session is using (e.g. a warm
+        # browser in another bucket). Only runs on the full-pool path, so the scan is fine.
+        for browser_key, count in self._ctx_counts.items():
+            if count == 0:
+                await self._close_pooled_browser(browser_key)
+                return True
+        return False
+
+    async def _release_browser_slot(self, browser_key: int):
+        # Free one context slot; close the browser once it is empty (keeping the warm pool alive
+        # unless the browser has been retired)
+        if self._release_slot(browser_key) != 0:
+            return
+        retired = browser_key in self._retiring
+        if retired or len(self.browsers) > self._warm_pool_size:
+            await self._close_pooled_browser(browser_key)
+            if retired and len(self.browsers) < self._warm_pool_size:
+                self._schedule_refill()
+
+    def _schedule_refill(self):
+        # Relaunch retired warm browsers off the request path
+        if self._refill_task is None or self._refill_task.done():
+            self._refill_task = asyncio.ensure_future(self.warmup(self._warm_pool_size))
+            self._refill_task.add_done_callback(_log_refill_failure)
+
+    def _cache_content(self, rec: SessionRecord, url: str, dom_gen: int, html: str):
+        self._drop_cached_content(rec.session_id)
+        if dom_gen < 0 or len(html) > CONTENT_CACHE_MAX_CHARS:
+            return
+        self._content_cache[rec.session_id] = (rec.version, url, dom_gen, html)
+        self._content_cache_chars += len(html)
+        while self._content_cache_chars > CONTENT_CACHE_MAX_CHARS:
+            _, (_, _, _, evicted) = self._content_cache.popitem(last=False)
+            self._content_cache_chars -= len(evicted)
+
+    def _drop_cached_content(self, session_id: str):
+        entry = self._content_cache.pop(session_id, None)
+        if entry is not None:
+            self._content_cache_chars -= len(entry[3])
+
+    def _unref_shared_context(self, context_id: str) -> Optional[Tuple[BrowserContext, int]]:
+        # Drop one session's reference; returns (context, browser_key) when it was the last one
+        refs = self._context_refs[context_id] - 1
+        if refs:
+            self._context_refs[context_id] = refs
+            return None
+        del self._context_refs[context_id]
+        return self._shared_contexts.pop(context_id)
+
+    def _unref_persistent_context(self, user_data_dir: str) -> bool:
+        # Drop one session's reference; True when it was the last one
+        refs = self._persistent_refs[user_data_dir] - 1
+        if refs:
+            self._persistent_refs[user_data_dir] = refs
+            return False
+        del self._persistent_refs[user_data_dir]
+        del self._persistent_contexts[user_data_dir]
+        return True
+
+    async def _open_persistent_page(self, user_data_dir: str, browser_type: str, headless: Optional[bool], viewport: Optional[Dict[str, int]]) -> Tuple[BrowserContext, Page]:
+        """Open a page in the persistent context for user_data_dir, launching it on first use.
+
+        Concurrent callers for the same directory await one launch task, since a browser profile
+        can only be opened by one process at a time.
+        """
+        await self._ensure_playwright()
+        launcher = self._launchers.get(browser_type)
+        if launcher is None:
+            raise BrowserAutomationError(f"Unsupported browser type: {browser_type}")
+        task = self._persistent_contexts.get(user_data_dir)
+        first = task is None
+        if first:
+            kwargs: Dict[str, Any] = {"headless": self.headless if headless is None else headless, "viewport": viewport}
+            if browser_type == "chromium":
+                kwargs.update(args=self.launch_args, chromium_sandbox=False)
+            task = asyncio.ensure_future(launcher.launch_persistent_context(user_data_dir, **kwargs))
+            self._persistent_contexts[user_data_dir] = task
+            self._persistent_refs[user_data_dir] = 0
+        self._persistent_refs[user_data_dir] += 1
+        context: Optional[BrowserContext] = None
+        try:
+            context = await task
+            # The first session takes the blank page the persistent context opens with
+            pages = context.pages if first else None
+            page = pages[0] if pages else await context.new_page()
+            return context, page
+        except Exception:
+            if self._unref_persistent_context(user_data_dir) and context is not None:
+                with suppress(Exception):
+                    await context.close()
+            raise
+
+    async def warmup(self, count: Optional[int] = None) -> int:
+        """Concurrently pre-launch idle Chromium browsers (up to max_browsers) so the first create_session only opens a context.
+
+        Returns the number of browsers launched. Warm browsers are kept alive when their sessions close.
+        """
+        target = self.max_browsers if count is None else min(count, self.max_browsers)
+        needed = target - len(self.browsers)
+        launched = 0
+        if needed > 0:
+            # Start Playwright up front so the concurrent launches don't each try to start it
+            await self._ensure_playwright()
+            results = await asyncio.gather(
+                *(self._launch_browser("chromium") for _ in range(needed)),
+                return_exceptions=True
+            )
+            errors = []
+            for result in results:
+                if isinstance(result, BaseException):
+                    errors.append(result)
+                else:
+                    self._add_pooled_browser(result, ("chromium", self.headless))
+                    launched += 1
+            if errors:
+                logger.error("Error warming up browser pool: %s", errors[0], exc_info=errors[0] if logger.isEnabledFor(logging.DEBUG) else None)
+                raise BrowserAutomationError(f"Failed to warm up browsers: {errors[0]}")
+        self._warm_pool_size = max(self._warm_pool_size, target)
+        logger.info(f"Browser pool warmed with {launched} new browser(s). Total browsers: {len(self.browsers)}")
+        return launched
+
+    async def create_session(self, session_id: Optional[str] = None, browser_type: str = "chromium", headless: Optional[bool] = None, viewport_width: Optional[int] = None, viewport_height: Optional[int] = None, context_id: Optional[str] = None, default_timeout: Optional[int] = None, user_data_dir: Optional[str] = None) -> Dict[str, Any]:
+        """Open a session on a pooled browser.
+
+        Sessions created with the same context_id share one BrowserContext (cookies, storage, cache),
+        so only the first pays for new_context(); later ones just open a page in it and ignore the
+        browser/viewport options. Distinct context_ids stay isolated. default_timeout (ms) overrides the
+        service-wide timeout for this session only.
+
+        With user_data_dir the session instead runs in a persistent context launched on that profile
+        directory (outside the pool), so cookies, logins and caches survive across sessions and
+        restarts. Sessions naming the same directory share its context; the directory is kept on disk
+        when the last one closes. context_id is ignored in this mode.
+        """
+        session_timeout = default_timeout or self.timeout
         try:
             if not session_id:
                 session_id = str(uuid4())
-            if session_id in self.pages:
+            if session_id in self.sessions:
                 raise BrowserAutomationError(f"Session ID {session_id} already exists.")
-
-            # Find an existing browser or launch a new one
-            browser_instance = None
-            # If a per-session headless override is provided, prefer launching a new browser
-            prefer_new_browser = headless is not None and headless != self.headless
-            if not prefer_new_browser:
-                for _b_id, b in self.browsers.items():
-                    if len(b.contexts) < self.max_contexts_per_browser:
-                        browser_instance = b
-                        break
-            
-            if not browser_instance:
-                if self._browser_counter >= self.max_browsers:
-                    raise BrowserAutomationError("Maximum number of browser instances reached.")
-                browser_instance = await self._launch_browser(browser_type, headless=headless)
-                browser_key = str(id(browser_instance))
-                self.browsers[browser_key] = browser_instance
-
-            context = await browser_instance.new_context(
-                viewport={"width": viewport_width, "height": viewport_height} if viewport_width and viewport_height else None
-            )
-            page = await context.new_page()
-
-            self.contexts[session_id] = context
-            self.pages[session_id] = page
+            if self.max_sessions is not None and len(self.sessions) >= self.max_sessions:
+                await self._evict_idle_sessions(self.max_sessions - 1)
+
+            if user_data_dir:
+                viewport = {"width": viewport_width, "height": viewport_height} if viewport_width and viewport_height else None
+                context, page = await self._open_persistent_page(user_data_dir, browser_type, headless, viewport)
+                rec = SessionRecord(session_id=session_id, page=page, context=context, timeout=session_timeout, user_data_dir=user_data_dir)
+                self.sessions[session_id] = rec
+                await self._track_navigation(rec)
+                logger.info(f"Created new session: {session_id} in persistent context {user_data_dir}")
+                return {"session_id": session_id, "browser_type": browser_type, "headless": headless if headless is not None else self.headless, "user_data_dir": user_data_dir}
+
+            shared = self._shared_contexts.get(context_id) if context_id else None
+            if shared is not None:
+                context, browser_key = shared
+                # Take the reference before awaiting so a concurrent close can't tear the context down
+                self._context_refs[context_id] += 1
+                try:
+                    page = await context.new_page()
+                except Exception:
+                    if self._unref_shared_context(context_id) is not None:
+                        with suppress(Exception):
+                            await context.close()
+                        await self._release_browser_slot(browser_key)
+                    raise
+                rec = SessionRecord(session_id=session_id, page=page, context=context, browser_key=browser_key, context_id=context_id, timeout=session_timeout)
+                self.sessions[session_id] = rec
+                await self._track_navigation(rec)
+                logger.info(f"Created new session: {session_id} in shared context {context_id}")
+                return {"session_id": session_id, "browser_type": browser_type, "headless": headless if headless is not None else self.headless, "context_id": context_id}
+
+            # Take a browser with spare capacity from the matching (browser_type, headless) bucket,
+            # launching another one for the bucket only once its browsers are full
+            bucket = (browser_type, self.headless if headless is None else headless)
+            # When every browser is full and max_browsers is reached, wait (up to the session
+            # timeout) for a slot to be released instead of failing straight away.
+            deadline = None
+            while True:
+                free = self._free_browsers.get(bucket)
+                if free:
+                    browser_key = free.popleft()
+                    browser_instance = self.browsers[browser_key]
+                    break
+                if len(self.browsers) < self.max_browsers or await self._close_idle_browser():
+                    browser_instance = await self._launch_browser(browser_type, headless=bucket[1])
+                    browser_key = self._add_pooled_browser(browser_instance, bucket)
+                    self._free_list_of[browser_key].remove(browser_key)
+                    break
+                if deadline is None:
+                    deadline = asyncio.get_running_loop().time() + session_timeout / 1000
+                await self._wait_for_capacity(deadline)
+            # Reserve the slot before awaiting so concurrent creates can't overfill the browser
+            self._acquire_slot(browser_key)
+
+            context = None
+            try:
+                context = await browser_instance.new_context(
+                    viewport={"width": viewport_width, "height": viewport_height} if viewport_width and viewport_height else None
+                )
+                page = await context.new_page()
+            except Exception:
+                # Don't leak the context if new_page fails after new_context succeeded
+                if context is not None:
+                    with suppress(Exception):
+                        await context.close()
+                await self._release_browser_slot(browser_key)
+                raise
+
+            if context_id and context_id not in self._shared_contexts:
+                self._shared_contexts[context_id] = (context, browser_key)
+                self._context_refs[context_id] = 1
+            elif context_id:
+                # Another create registered this context_id while we were awaiting; keep ours private
+                context_id = None
+            rec = SessionRecord(session_id=session_id, page=page, context=context, browser_key=browser_key, context_id=context_id, timeout=session_timeout)
+            self.sessions[session_id] = rec
+            await self._track_navigation(rec)
             logger.info(f"Created new session: {session_id} with browser type {browser_type}")
-            return {"session_id": session_id, "browser_type": browser_type, "headless": headless if headless is not None else self.headless}
+            info = {"session_id": session_id, "browser_type": browser_type, "headless": headless if headless is not None else self.headless}
+            if context_id:
+                info["context_id"] = context_id
+            return info
         except Exception as e:
-            logger.error(f"Error creating session {session_id}: {e}", exc_info=True)
+            _log_exc("Error creating session %s: %s", session_id, e)
             raise BrowserAutomationError(f"Failed to create session: {e}")
 
+    @asynccontextmanager
+    async def session(self, **kwargs: Any) -> AsyncIterator[SessionRecord]:
+        """Create a session with create_session(**kwargs) and always close it on exit."""
+        info = await self.create_session(**kwargs)
+        session_id = info["session_id"]
+        try:
+            yield self.sessions[session_id]
+        finally:
+            if session_id in self.sessions:
+                await self.close_session(session_id)
+
     async def connect_cdp_session(self, session_id: Optional[str] = None, cdp_url: str = "http://localhost:9222", create_new_page: bool = True) -> Dict[str, Any]:
         """Connect to an existing, user-launched Chromium/Chrome via CDP. Leaves the browser visible and user-controllable.
 
@@ -143,14 +788,15 @@ class BrowserService:
         Then call this method with cdp_url="http://localhost:9222".
         """
         try:
-            if not self.playwright_instance:
-                self.playwright_instance = await async_playwright().start()
+            await self._ensure_playwright()
             if not session_id:
                 session_id = str(uuid4())
-            if session_id in self.pages:
+            if session_id in self.sessions:
                 raise BrowserAutomationError(f"Session ID {session_id} already exists.")
+            if self.max_sessions is not None and len(self.sessions) >= self.max_sessions:
+                await self._evict_idle_sessions(self.max_sessions - 1)
 
-            browser = await self.playwright_instance.chromium.connect_over_cdp(cdp_url)
+            browser = await self._launchers["chromium"].connect_over_cdp(cdp_url)
             # For persistent Chrome, there is usually a single context
             contexts = browser.contexts
             if not contexts:
@@ -165,184 +811,291 @@ class BrowserService:
             else:
                 page = context.pages[0]
 
-            browser_key = str(id(browser))
-            self.browsers[browser_key] = browser
-            self.contexts[session_id] = context
-            self.pages[session_id] = page
-            self._cdp_sessions.add(session_id)
+            self._cdp_browsers.append(browser)
+            rec = SessionRecord(session_id=session_id, page=page, context=context, cdp=True, timeout=self.timeout)
+            self.sessions[session_id] = rec
+            await self._track_navigation(rec)
             logger.info(f"Connected CDP session: {session_id} via {cdp_url}")
             return {"session_id": session_id, "browser_type": "chromium", "cdp_url": cdp_url, "headless": False}
         except Exception as e:
-            logger.error(f"Error connecting CDP session {session_id} to {cdp_url}: {e}", exc_info=True)
+            _log_exc("Error connecting CDP session %s to %s: %s", session_id, cdp_url, e)
             raise BrowserAutomationError(f"Failed to connect via CDP: {e}")
 
-    async def close_session(self, session_id: str):
-        if session_id not in self.pages:
-            raise SessionNotFoundError(session_id)
+    @requires_session
+    async def close_session(self, rec: SessionRecord):
+        session_id = rec.session_id
+        del self.sessions[session_id]
+        self._drop_cached_content(session_id)
+        self._ax_cache.pop(session_id, None)
+        self._shot_cache.pop(session_id, None)
         try:
-            page = self.pages.pop(session_id)
-            context = self.contexts.pop(session_id)
-            await page.close()
-            # For CDP sessions (user-managed), do not close the persistent context/browser
-            if session_id in self._cdp_sessions:
-                self._cdp_sessions.discard(session_id)
+            # For CDP sessions (user-managed), do not close the persistent context/browser;
+            # a shared context only closes with the last session using it
+            if rec.cdp:
+                close_context = False
+            elif rec.user_data_dir is not None:
+                # Closing a persistent context also shuts down the browser it was launched with
+                close_context = self._unref_persistent_context(rec.user_data_dir)
+            elif rec.context_id is not None:
+                close_context = self._unref_shared_context(rec.context_id) is not None
             else:
-                await context.close()
+                close_context = True
+            closers = [rec.page.close(), rec.context.close()] if close_context else [rec.page.close()]
+            errors = [r for r in await asyncio.gather(*closers, return_exceptions=True) if isinstance(r, BaseException)]
+            for err in errors:
+                logger.warning(f"Error during teardown of session {session_id}: {err}")
             logger.info(f"Closed session: {session_id}")
 
-            # If the browser has no more contexts, close it
-            browser_key_to_close = None
-            for b_id, b in list(self.browsers.items()):
-                if not b.contexts:
-                    await b.close()
-                    browser_key_to_close = b_id
-                    break
-            if browser_key_to_close:
-                self.browsers.pop(browser_key_to_close, None)
-                self._browser_counter -= 1
-                logger.info(f"Closed browser instance. Total browsers: {self._browser_counter}")
+            if close_context and rec.browser_key is not None:
+                await self._release_browser_slot(rec.browser_key)
 
         except Exception as e:
-            logger.error(f"Error closing session {session_id}: {e}", exc_info=True)
+            _log_exc("Error closing session %s: %s", session_id, e)
             raise BrowserAutomationError(f"Failed to close session: {e}")
 
-    async def navigate(self, session_id: str, url: str, wait_until: str = "load"):
-        if session_id not in self.pages:
-            raise SessionNotFoundError(session_id)
+    @requires_session
+    async def navigate(self, rec: SessionRecord, url: str, wait_until: str = "load"):
+        async with rec.lock:
+            await self._navigate(rec, url, wait_until)
+
+    async def _navigate(self, rec: SessionRecord, url: str, wait_until: str = "load"):
         try:
-            page = self.pages[session_id]
-            await page.goto(url, wait_until=wait_until, timeout=self.timeout)
-            logger.info(f"Session {session_id} navigated to {url}")
+            parts = urlsplit(url)
+        except ValueError:
+            raise InvalidURLError(url)
+        scheme = parts.scheme.lower()
+        if scheme not in NAVIGABLE_SCHEMES or (scheme in _HOST_SCHEMES and not parts.netloc):
+            raise InvalidURLError(url)
+        try:
+            page = rec.page
+            async with self._gate(rec):
+                await page.goto(url, wait_until=wait_until, timeout=rec.timeout)
+            logger.info(f"Session {rec.session_id} navigated to {url}")
         except Exception as e:
-            logger.error(f"Error navigating session {session_id} to {url}: {e}", exc_info=True)
-            if "ERR_INVALID_URL" in str(e):
-                raise InvalidURLError(url)
-            raise NavigationError(url, message=str(e))
-
-    async def click_element(self, session_id: str, selector: str, timeout: Optional[int] = None):
-        if session_id not in self.pages:
-            raise SessionNotFoundError(session_id)
+            _log_exc("Error navigating session %s to %s: %s", rec.session_id, url, e)
+            raise _classify_navigation_error(url, e)
+        finally:
+            # Bumped once the action settles so a content read that overlapped it is not cached
+            rec.version += 1
+
+    @requires_session
+    async def click_element(self, rec: SessionRecord, selector: str, timeout: Optional[int] = None):
+        async with rec.lock:
+            await self._click_element(rec, selector, timeout)
+
+    async def _click_element(self, rec: SessionRecord, selector: str, timeout: Optional[int] = None):
         try:
-            page = self.pages[session_id]
-            await page.click(selector, timeout=timeout if timeout is not None else self.timeout)
-            logger.info(f"Session {session_id} clicked element {selector}")
+            page = rec.page
+            async with self._gate(rec):
+                await page.click(selector, timeout=timeout if timeout is not None else rec.timeout)
+            logger.info(f"Session {rec.session_id} clicked element {selector}")
         except Exception as e:
-            logger.error(f"Error clicking element {selector} in session {session_id}: {e}", exc_info=True)
-            if "not found" in str(e).lower():
-                raise ElementNotFoundError(selector)
-            if "not interactable" in str(e).lower():
-                raise ElementNotInteractableError(selector)
-            if "selector" in str(e).lower() and "failed" in str(e).lower():
-                raise InvalidSelectorError(selector)
-            raise ElementError(selector, message=str(e))
-
-    async def type_text(self, session_id: str, selector: str, text: str, timeout: Optional[int] = None):
-        if session_id not in self.pages:
-            raise SessionNotFoundError(session_id)
+            _log_exc("Error clicking element %s in session %s: %s", selector, rec.session_id, e)
+            raise _classify_element_error(selector, e)
+        finally:
+            rec.version += 1
+
+    @requires_session
+    async def type_text(self, rec: SessionRecord, selector: str, text: str, timeout: Optional[int] = None):
+        async with rec.lock:
+            await self._type_text(rec, selector, text, timeout)
+
+    async def _type_text(self, rec: SessionRecord, selector: str, text: str, timeout: Optional[int] = None):
         try:
-            page = self.pages[session_id]
-            await page.fill(selector, text, timeout=timeout if timeout is not None else self.timeout)
-            logger.info(f"Session {session_id} typed text into element {selector}")
+            page = rec.page
+            async with self._gate(rec):
+                await page.fill(selector, text, timeout=timeout if timeout is not None else rec.timeout)
+            logger.info(f"Session {rec.session_id} typed text into element {selector}")
         except Exception as e:
-            logger.error(f"Error typing text into element {selector} in session {session_id}: {e}", exc_info=True)
-            if "not found" in str(e).lower():
-                raise ElementNotFoundError(selector)
-            if "not interactable" in str(e).lower():
-                raise ElementNotInteractableError(selector)
-            if "selector" in str(e).lower() and "failed" in str(e).lower():
-                raise InvalidSelectorError(selector)
-            raise ElementError(selector, message=str(e))
-
-    async def press_key(self, session_id: str, key: str, delay: Optional[int] = None):
-        if session_id not in self.pages:
-            raise SessionNotFoundError(session_id)
+            _log_exc("Error typing text into element %s in session %s: %s", selector, rec.session_id, e)
+            raise _classify_element_error(selector, e)
+        finally:
+            rec.version += 1
+
+    @requires_session
+    async def press_key(self, rec: SessionRecord, key: str, delay: Optional[int] = None):
+        async with rec.lock:
+            await self._press_key(rec, key, delay)
+
+    async def _press_key(self, rec: SessionRecord, key: str, delay: Optional[int] = None):
         try:
-            page = self.pages[session_id]
+            page = rec.page
             if delay is not None:
                 await page.keyboard.press(key, delay=max(0, int(delay)))
             else:
                 await page.keyboard.press(key)
-            logger.info(f"Session {session_id} pressed key {key}")
+            logger.info(f"Session {rec.session_id} pressed key {key}")
         except Exception as e:
-            logger.error(f"Error pressing key {key} in session {session_id}: {e}", exc_info=True)
+            _log_exc("Error pressing key %s in session %s: %s", key, rec.session_id, e)
             raise BrowserAutomationError(f"Failed to press key {key}: {e}")
+        finally:
+            rec.version += 1
 
-    async def get_page_content(self, session_id: str, selector: Optional[str] = None, content_format: str = "html") -> str:
-        if session_id not in self.pages:
-            raise SessionNotFoundError(session_id)
+    @requires_session
+    async def chain(self, rec: SessionRecord, actions: List[Dict[str, Any]], settle_timeout: int = 1500, compact: bool = True) -> Dict[str, Any]:
+        """Run several actions back to back under the session lock, then return one accessibility snapshot.
+
+        Each action is a dict with "action" ("navigate", "click", "type" or "press") and that
+        method's arguments: url/wait_until, selector/timeout, selector/text/timeout, key/delay.
+        After the last action the page gets up to settle_timeout ms to reach network idle, so an
+        agent gets act + wait + observe in one call. The first failing action raises its usual error.
+        """
+        async with rec.lock:
+            for index, step in enumerate(actions):
+                kind = step.get("action")
+                try:
+                    if kind == "navigate":
+                        await self._navigate(rec, step["url"], step.get("wait_until") or "load")
+                    elif kind == "click":
+                        await self._click_element(rec, step["selector"], step.get("timeout"))
+                    elif kind == "type":
+                        await self._type_text(rec, step["selector"], step["text"], step.get("timeout"))
+                    elif kind == "press":
+                        await self._press_key(rec, step["key"], step.get("delay"))
+                    else:
+                        raise BrowserAutomationError(f"Unsupported action at step {index}: {kind!r}")
+                except KeyError as e:
+                    raise BrowserAutomationError(f"Step {index} ({kind}) is missing {e.args[0]!r}") from None
+            if actions and settle_timeout > 0:
+                # Best effort: pages with long-polling never go idle, so a timeout just ends the wait
+                with suppress(PlaywrightTimeoutError):
+                    async with self._gate(rec):
+                        await rec.page.wait_for_load_state("networkidle", timeout=settle_timeout)
+            tree = await self.get_accessibility_tree(rec.session_id, compact=compact)
+        return {"session_id": rec.session_id, "steps": len(actions), "url": rec.url, "tree": tree}
+
+    @requires_session
+    async def get_page_text(self, rec: SessionRecord, selector: Optional[str] = None, max_chars: Optional[int] = None) -> str:
+        """Return the visible text (innerText) of the page body, or of the first element matching selector.
+
+        This is the light path for callers that only need text: nothing but the text crosses the
+        CDP channel, and max_chars truncates inside the page so the excess is never transferred.
+        """
+        limit = max_chars if isinstance(max_chars, int) and max_chars > 0 else None
         try:
-            page = self.pages[session_id]
-            if selector:
-                locator = page.locator(selector).first
-                if content_format == "text":
-                    content = await locator.inner_text()
+            page = rec.page
+            async with self._gate(rec):
+                if selector:
+                    text = await page.locator(selector).first.evaluate(
+                        "(el, limit) => { const t = el.innerText || ''; return limit ? t.slice(0, limit) : t; }",
+                        limit,
+                    )
                 else:
-                    content = await locator.inner_html()
-            else:
-                if content_format == "text":
-                    content = await page.inner_text("body")
+                    text = await page.evaluate(
+                        "(limit) => { const t = document.body ? document.body.innerText : ''; return limit ? t.slice(0, limit) : t; }",
+                        limit,
+                    )
+            logger.info(f"Session {rec.session_id} retrieved page text (selector={selector}, max_chars={limit})")
+            return text
+        except Exception as e:
+            _log_exc("Error getting page text for session %s: %s", rec.session_id, e)
+            raise BrowserAutomationError(f"Failed to get page text: {e}")
+
+    @requires_session
+    async def get_links(self, rec: SessionRecord, selector: Optional[str] = None, max_links: Optional[int] = None) -> List[Dict[str, str]]:
+        """Return {text, href} for the elements matching selector (default "a") that carry an href."""
+        try:
+            async with self._gate(rec):
+                links = await rec.page.eval_on_selector_all(
+                    selector or "a",
+                    "els => els.map(e => ({ text: (e.innerText||'').trim(), href: e.getAttribute('href') || '' }))",
+                )
+            links = [link for link in links if link.get("href")]
+            if isinstance(max_links, int) and max_links > 0:
+                links = links[:max_links]
+            return links
+        except Exception as e:
+            _log_exc("Error getting links for session %s: %s", rec.session_id, e)
+            raise BrowserAutomationError(f"Failed to get links: {e}")
+
+    @requires_session
+    async def get_page_content(self, rec: SessionRecord, selector: Optional[str] = None, content_format: str = "html") -> str:
+        """Return serialised HTML (the heavy path: page.content() ships the whole DOM), or text via get_page_text.
+
+        Full-document HTML is cached per session and reused while no navigate/click/type/press_key,
+        main-frame navigation or DOM mutation (counted in the page by _DOM_WATCH_SCRIPT) has happened
+        since, so repeated reads of a settled page cost one small evaluate instead of the serialisation.
+        """
+        if content_format == "text":
+            return await self.get_page_text(rec.session_id, selector=selector)
+        try:
+            page = rec.page
+            async with self._gate(rec):
+                if selector:
+                    # Scope markup to the subtree instead of serialising the whole document
+                    content = await page.locator(selector).first.inner_html()
                 else:
+                    # Read before page.content(), so a mutation in between only costs a later miss
+                    version = rec.version
+                    dom_gen = await page.evaluate(_DOM_GENERATION_JS)
+                    cached = self._content_cache.get(rec.session_id)
+                    if cached is not None and dom_gen >= 0 and cached[:3] == (version, rec.url, dom_gen):
+                        self._content_cache.move_to_end(rec.session_id)
+                        logger.info(f"Session {rec.session_id} retrieved page content from cache")
+                        return cached[3]
                     content = await page.content()
-            logger.info(f"Session {session_id} retrieved page content (format={content_format}, selector={selector})")
+            if not selector and rec.version == version:
+                self._cache_content(rec, rec.url, dom_gen, content)
+            logger.info(f"Session {rec.session_id} retrieved page content (format={content_format}, selector={selector})")
             return content
         except Exception as e:
-            logger.error(f"Error getting page content for session {session_id}: {e}", exc_info=True)
+            _log_exc("Error getting page content for session %s: %s", rec.session_id, e)
             raise BrowserAutomationError(f"Failed to get page content: {e}")
 
+    @requires_session
     async def describe_elements(
         self,
-        session_id: str,
+        rec: SessionRecord,
         selector: str,
         max_elements: int = 10,
         include_html_preview: bool = False,
         extra_attributes: Optional[List[str]] = None,
     ) -> Dict[str, Any]:
-        if session_id not in self.pages:
-            raise SessionNotFoundError(session_id)
         try:
-            page = self.pages[session_id]
-            locator = page.locator(selector)
-            total_matches = await locator.count()
-            limit = total_matches if max_elements is None or max_elements <= 0 else min(max_elements, total_matches)
+            page = rec.page
+            # One round-trip for the whole batch: every field, box and visibility flag is read
+            # in the page instead of 3-5 CDP calls per element.
+            total_matches, infos = await page.locator(selector).evaluate_all(
+                """
+                (els, opts) => {
+                    const limit = opts.limit > 0 ? Math.min(opts.limit, els.length) : els.length;
+                    const items = els.slice(0, limit).map(el => {
+                        const rects = el.getClientRects();
+                        const rect = el.getBoundingClientRect();
+                        const box = rects.length ? { x: rect.x, y: rect.y, width: rect.width, height: rect.height } : null;
+                        return {
+                            tag: el.tagName ? el.tagName.toLowerCase() : null,
+                            id: el.id || null,
+                            className: typeof el.className === 'string' ? el.className || null : null,
+                            name: el.getAttribute('name') || null,
+                            ariaLabel: el.getAttribute('aria-label') || null,
+                            role: el.getAttribute('role') || null,
+                            type: el.getAttribute('type') || null,
+                            placeholder: el.getAttribute('placeholder') || null,
+                            title: el.getAttribute('title') || null,
+                            href: el.getAttribute('href') || null,
+                            text: (el.innerText || '').trim(),
+                            value: typeof el.value === 'string' ? el.value : null,
+                            disabled: el.matches(':disabled'),
+                            checked: el.matches(':checked'),
+                            visible: rect.width > 0 && rect.height > 0 && getComputedStyle(el).visibility !== 'hidden',
+                            box,
+                            extra: opts.extraAttrs.length ? Object.fromEntries(opts.extraAttrs.map(name => [name, el.getAttribute(name)])) : null,
+                            outerHtml: opts.includeHtml ? (el.outerHTML || '').slice(0, 500) : null,
+                        };
+                    });
+                    return [els.length, items];
+                }
+                """,
+                {"limit": max_elements or 0, "includeHtml": include_html_preview, "extraAttrs": extra_attributes or []},
+            )
             results: List[Dict[str, Any]] = []
 
-            for index in range(limit):
-                element = locator.nth(index)
-                element_info = await element.evaluate(
-                    """
-                    (el) => ({
-                        tag: el.tagName ? el.tagName.toLowerCase() : null,
-                        id: el.id || null,
-                        className: el.className || null,
-                        name: el.getAttribute('name') || null,
-                        ariaLabel: el.getAttribute('aria-label') || null,
-                        role: el.getAttribute('role') || null,
-                        type: el.getAttribute('type') || null,
-                        placeholder: el.getAttribute('placeholder') || null,
-                        title: el.getAttribute('title') || null,
-                        href: el.getAttribute('href') || null,
-                        text: (el.innerText || '').trim(),
-                        value: typeof el.value === 'string' ? el.value : null,
-                        disabled: el.matches(':disabled'),
-                        checked: el.matches(':checked'),
-                    })
-                    """
-                )
-
-                classes_raw = element_info.pop("className", None)
+            for index, element_info in enumerate(infos):
+                classes_raw = element_info.get("className")
                 classes: Optional[List[str]] = None
                 if classes_raw:
-                    classes = [cls for cls in classes_raw.split() if cls]
-
-                extra_attrs: Dict[str, Any] = {}
-                if extra_attributes:
-                    extra_attrs = await element.evaluate(
-                        "(el, names) => Object.fromEntries(names.map(name => [name, el.getAttribute(name)]))",
-                        extra_attributes,
-                    )
-
-                bounding_box = await element.bounding_box()
-                visible = await element.is_visible()
+                    classes = classes_raw.split()
 
                 element_record: Dict[str, Any] = {
                     "index": index,
@@ -360,17 +1113,16 @@ class BrowserService:
                     "value": element_info.get("value"),
                     "disabled": element_info.get("disabled"),
                     "checked": element_info.get("checked"),
-                    "visible": visible,
-                    "bounding_box": bounding_box,
+                    "visible": element_info.get("visible"),
+                    "bounding_box": element_info.get("box"),
                 }
 
+                extra_attrs = element_info.get("extra")
                 if extra_attrs:
                     element_record["attributes"] = {k: v for k, v in extra_attrs.items() if v is not None}
 
                 if include_html_preview:
-                    outer_html = await element.evaluate("el => el.outerHTML || ''")
-                    preview = outer_html[:500]
-                    element_record["outer_html_preview"] = preview
+                    element_record["outer_html_preview"] = element_info.get("outerHtml") or ""
 
                 if element_record.get("tag") and (element_record.get("id") or classes):
                     parts: List[str] = [element_record["tag"]]
@@ -389,12 +1141,13 @@ class BrowserService:
                 "elements": results,
             }
         except Exception as e:
-            logger.error(f"Error describing elements for session {session_id} using {selector}: {e}", exc_info=True)
+            _log_exc("Error describing elements for session %s using %s: %s", rec.session_id, selector, e)
             raise BrowserAutomationError(f"Failed to describe elements: {e}")
 
+    @requires_session
     async def find_click_targets(
         self,
-        session_id: str,
+        rec: SessionRecord,
         text: str,
         exact: bool = False,
         case_sensitive: bool = False,
@@ -404,117 +1157,143 @@ class BrowserService:
         extra_attributes: Optional[List[str]] = None,
         scan_limit: Optional[int] = None,
     ) -> Dict[str, Any]:
-        if session_id not in self.pages:
-            raise SessionNotFoundError(session_id)
         if not text or not text.strip():
             raise BrowserAutomationError("Search text must be provided.")
         try:
-            page = self.pages[session_id]
-            target_text = text if case_sensitive else text.strip().lower()
+            page = rec.page
+            # Normalised once here; candidate fields are compared against it inside the page
+            needle = text.strip() if case_sensitive else text.strip().lower()
             roles_set: Optional[Set[str]] = {r.lower() for r in preferred_roles} if preferred_roles else None
             dedup_attrs = list(dict.fromkeys(extra_attributes or []))
 
-            locator = page.locator(CLICKABLE_SELECTOR)
-            total_candidates = await locator.count()
-            scan_cap = total_candidates
-            if scan_limit is not None and scan_limit > 0:
-                scan_cap = min(total_candidates, scan_limit)
-            else:
-                scan_cap = min(total_candidates, 200)
-
-            matches: List[Dict[str, Any]] = []
-            matched_count = 0
-
-            for index in range(scan_cap):
-                element = locator.nth(index)
-                try:
-                    info = await element.evaluate(
-                        """
-                        (el, attrs) => {
-                            const rect = el.getBoundingClientRect();
-                            const attrEntries = {};
-                            if (Array.isArray(attrs)) {
-                                for (const name of attrs) {
-                                    attrEntries[name] = el.getAttribute(name);
-                                }
+            cap_limit = scan_limit if scan_limit is not None and scan_limit > 0 else 200
+
+            # One evaluate_all scans the candidates and matches them in the page, so only
+            # matching elements (with visibility and enabled state) cross the CDP channel.
+            total_candidates, scan_cap, found, uncollected = await page.locator(CLICKABLE_SELECTOR).evaluate_all(
+                """
+                (els, opts) => {
+                    const cap = Math.min(opts.cap, els.length);
+                    const found = [];
+                    let scanned = 0;
+                    let strong = 0;
+                    let settled = false;
+                    let extra = 0;
+                    for (let index = 0; index < cap; index++) {
+                        const el = els[index];
+                        scanned = index + 1;
+                        const role = el.getAttribute('role') || null;
+                        if (opts.roles && (!role || !opts.roles.includes(role.toLowerCase()))) {
+                            continue;
+                        }
+                        const text = (el.innerText || el.textContent || '').trim();
+                        const ariaLabel = el.getAttribute('aria-label') || null;
+                        const title = el.getAttribute('title') || null;
+                        const value = typeof el.value === 'string' ? el.value : null;
+                        const attrEntries = {};
+                        const pool = [
+                            ['text', text],
+                            ['aria_label', (ariaLabel || '').trim()],
+                            ['title', (title || '').trim()],
+                            ['value', (value || '').trim()],
+                        ];
+                        for (const name of opts.attrs) {
+                            const attrValue = el.getAttribute(name);
+                            attrEntries[name] = attrValue;
+                            if (attrValue) {
+                                pool.push(['attr:' + name, attrValue.trim()]);
                             }
-                            return {
-                                tag: el.tagName ? el.tagName.toLowerCase() : null,
-                                text: (el.innerText || el.textContent || '').trim(),
-                                id: el.id || null,
-                                className: el.className || null,
-                                role: el.getAttribute('role') || null,
-                                href: el.getAttribute('href') || null,
-                                ariaLabel: el.getAttribute('aria-label') || null,
-                                title: el.getAttribute('title') || null,
-                                value: typeof el.value === 'string' ? el.value : null,
-                                disabled: el.matches(':disabled'),
-                                checked: el.matches(':checked'),
-                                rect: { x: rect.x, y: rect.y, width: rect.width, height: rect.height },
-                                attributes: attrEntries,
-                            };
                         }
-                        """,
-                        dedup_attrs,
-                    )
-                except Exception:
-                    continue
+                        let match = null;
+                        for (const [field, fieldValue] of pool) {
+                            if (!fieldValue) {
+                                continue;
+                            }
+                            const compare = opts.caseSensitive ? fieldValue : fieldValue.toLowerCase();
+                            if (opts.exact ? compare === opts.needle : compare.includes(opts.needle)) {
+                                match = { field, value: fieldValue, exact: compare === opts.needle };
+                                break;
+                            }
+                        }
+                        if (!match) {
+                            continue;
+                        }
+                        // Top results already settled: only count the match so total_matches stays exact
+                        if (settled) {
+                            extra++;
+                            continue;
+                        }
+                        const rect = el.getBoundingClientRect();
+                        const disabled = el.matches(':disabled');
+                        const visible = rect.width > 0 && rect.height > 0 && getComputedStyle(el).visibility !== 'hidden';
+                        const enabled = !disabled && el.getAttribute('aria-disabled') !== 'true';
+                        found.push({
+                            index,
+                            tag: el.tagName ? el.tagName.toLowerCase() : null,
+                            text,
+                            id: el.id || null,
+                            className: typeof el.className === 'string' ? el.className || null : null,
+                            role,
+                            href: el.getAttribute('href') || null,
+                            ariaLabel,
+                            title,
+                            value,
+                            disabled,
+                            checked: el.matches(':checked'),
+                            visible,
+                            enabled,
+                            rect: { x: rect.x, y: rect.y, width: rect.width, height: rect.height },
+                            attributes: attrEntries,
+                            matchField: match.field,
+                            matchValue: match.value,
+                            exactMatch: match.exact,
+                            outerHtml: opts.includeHtml ? (el.outerHTML || '').slice(0, 500) : null,
+                        });
+                        // Enough exact, visible, enabled hits to fill the top results: stop collecting
+                        if (opts.stopAfter && match.exact && visible && enabled && ++strong >= opts.stopAfter) {
+                            settled = true;
+                        }
+                    }
+                    return [els.length, scanned, found, extra];
+                }
+                """,
+                {
+                    "cap": cap_limit,
+                    "stopAfter": max_results * 3 if max_results and max_results > 0 else 0,
+                    "attrs": dedup_attrs,
+                    "roles": sorted(roles_set) if roles_set else None,
+                    "needle": needle,
+                    "caseSensitive": case_sensitive,
+                    "exact": exact,
+                    "includeHtml": include_html_preview,
+                },
+            )
 
-                if not info:
-                    continue
+            matches: List[Dict[str, Any]] = []
+            matched_count = len(found) + uncollected
+            # Loop invariants for the length-similarity term of the score
+            text_len = len(text)
+            text_len_inv = 1.0 / max(text_len, 1)
 
+            for info in found:
+                index = info["index"]
                 role = info.get("role")
-                if roles_set and (role is None or role.lower() not in roles_set):
-                    continue
 
                 classes_raw = info.get("className") or ""
-                classes = [cls for cls in classes_raw.split() if cls]
+                classes = classes_raw.split()
 
                 attributes = info.get("attributes") or {}
-
-                search_pool: List[tuple[str, str]] = []
-                text_value = (info.get("text") or "").strip()
-                if text_value:
-                    search_pool.append(("text", text_value))
+                text_value = info.get("text") or ""
                 aria_label = (info.get("ariaLabel") or "").strip()
-                if aria_label:
-                    search_pool.append(("aria_label", aria_label))
                 title_value = (info.get("title") or "").strip()
-                if title_value:
-                    search_pool.append(("title", title_value))
-                value_attr = (info.get("value") or "").strip()
-                if value_attr:
-                    search_pool.append(("value", value_attr))
-                for attr_name, attr_value in attributes.items():
-                    if attr_value:
-                        search_pool.append((f"attr:{attr_name}", attr_value.strip()))
-
-                matched_field: Optional[str] = None
-                matched_value: Optional[str] = None
-                exact_match = False
-
-                for field_name, field_value in search_pool:
-                    if not field_value:
-                        continue
-                    compare_value = field_value if case_sensitive else field_value.lower()
-                    needle = text if case_sensitive else target_text
-                    if not needle:
-                        continue
-                    match_found = compare_value == needle if exact else needle in compare_value
-                    if match_found:
-                        matched_field = field_name
-                        matched_value = field_value
-                        exact_match = compare_value == needle
-                        break
-
-                if not matched_field:
-                    continue
 
-                matched_count += 1
+                matched_field: str = info["matchField"]
+                matched_value: str = info["matchValue"]
+                exact_match: bool = info["exactMatch"]
 
                 bounding_box = info.get("rect") or {}
-                visible = await element.is_visible()
-                enabled = await element.is_enabled()
+                visible = info.get("visible")
+                enabled = info.get("enabled")
 
                 suggested_locator = None
                 tag = info.get("tag")
@@ -543,14 +1322,15 @@ class BrowserService:
                     score -= 1.5
                 if role and role.lower() in CLICKABLE_ROLE_HINTS:
                     score += 1.0
-                if tag in {"button", "a", "input", "ytmusic-responsive-list-item-renderer"}:
+                if tag in _CLICK_BONUS_TAGS:
                     score += 0.5
-                if classes and any("play" in cls.lower() for cls in classes):
+                # "play" has no whitespace, so a hit in the raw class string is a hit in some class
+                if "play" in classes_raw.lower():
                     score += 0.4
                 if matched_value:
-                    similarity = 1.0 - min(abs(len(matched_value) - len(text)) / max(len(text), 1), 1.0)
+                    similarity = 1.0 - min(abs(len(matched_value) - text_len) * text_len_inv, 1.0)
                     score += 0.5 * similarity
-                confidence = max(0.0, min(score / 6.0, 1.0))
+                confidence = round(max(0.0, min(score / 6.0, 1.0)), 2)
 
                 record: Dict[str, Any] = {
                     "index": index,
@@ -572,7 +1352,7 @@ class BrowserService:
                     "match_text": matched_value,
                     "exact_match": exact_match,
                     "suggested_locator": suggested_locator,
-                    "confidence": round(confidence, 2),
+                    "confidence": confidence,
                 }
 
                 filtered_attributes = {k: v for k, v in attributes.items() if v}
@@ -580,27 +1360,19 @@ class BrowserService:
                     record["attributes"] = filtered_attributes
 
                 record["text_snippet"] = (text_value or matched_value or "")[:120] if (text_value or matched_value) else None
-                record["_element_index"] = index
+                record["_outer_html"] = info.get("outerHtml")
+                record["_sort_key"] = (-confidence, index)
 
                 matches.append(record)
 
-            matches.sort(key=lambda item: (-item["confidence"], item["index"]))
+            matches.sort(key=_BY_SORT_KEY)
             limited_matches = matches[: max_results if max_results and max_results > 0 else len(matches)]
 
-            if include_html_preview and limited_matches:
-                for entry in limited_matches:
-                    idx = entry.get("_element_index")
-                    if idx is None:
-                        continue
-                    element = locator.nth(idx)
-                    try:
-                        outer_html = await element.evaluate("el => el.outerHTML || ''")
-                        entry["outer_html_preview"] = outer_html[:500]
-                    except Exception:
-                        continue
-
             for entry in limited_matches:
-                entry.pop("_element_index", None)
+                del entry["_sort_key"]
+                html_preview = entry.pop("_outer_html", None)
+                if include_html_preview:
+                    entry["outer_html_preview"] = html_preview or ""
                 if not entry.get("text_snippet"):
                     entry.pop("text_snippet", None)
 
@@ -619,55 +1391,76 @@ class BrowserService:
         except BrowserAutomationError:
             raise
         except Exception as e:
-            logger.error(f"Error finding click targets for session {session_id}: {e}", exc_info=True)
+            _log_exc("Error finding click targets for session %s: %s", rec.session_id, e)
             raise BrowserAutomationError(f"Failed to find click targets: {e}")
 
+    @requires_session
     async def click_by_text(
         self,
-        session_id: str,
+        rec: SessionRecord,
+        text: str,
+        exact: bool = False,
+        preferred_roles: Optional[List[str]] = None,
+        timeout: Optional[int] = None,
+        nth: Optional[int] = None,
+    ) -> Dict[str, Any]:
+        # Held across resolve + click so a concurrent chain()/navigate can't change the page in between
+        async with rec.lock:
+            return await self._click_by_text(rec, text, exact, preferred_roles, timeout, nth)
+
+    async def _click_by_text(
+        self,
+        rec: SessionRecord,
         text: str,
         exact: bool = False,
         preferred_roles: Optional[List[str]] = None,
         timeout: Optional[int] = None,
         nth: Optional[int] = None,
     ) -> Dict[str, Any]:
-        if session_id not in self.pages:
-            raise SessionNotFoundError(session_id)
         if not text or not text.strip():
             raise BrowserAutomationError("Text must be provided for click_by_text.")
         try:
-            page = self.pages[session_id]
+            page = rec.page
             search_text = text.strip()
+            click_timeout = timeout if timeout is not None else rec.timeout
             roles_set: Optional[Set[str]] = {r.lower() for r in preferred_roles} if preferred_roles else None
 
             locator = page.get_by_text(search_text, exact=exact)
-            candidate_count = await locator.count()
+            # Role and visibility of every candidate in one round-trip (the length doubles as
+            # the count) instead of get_attribute + is_visible per candidate
+            states = await locator.evaluate_all(
+                """
+                els => els.map(el => {
+                    const rect = el.getBoundingClientRect();
+                    return [el.getAttribute('role'), rect.width > 0 && rect.height > 0 && getComputedStyle(el).visibility !== 'hidden'];
+                })
+                """
+            )
+            candidate_count = len(states)
             if candidate_count == 0:
                 raise ElementNotFoundError(search_text)
 
-            indices: List[int]
+            # Bounds are checked once here; a plain range avoids materialising the index list
+            indices: Sequence[int]
             if nth is not None:
-                indices = [nth]
+                indices = (nth,) if 0 <= nth < candidate_count else ()
             else:
-                indices = list(range(candidate_count))
+                indices = range(candidate_count)
 
             last_error: Optional[Exception] = None
 
             for idx in indices:
-                if idx < 0 or idx >= candidate_count:
+                role, visible = states[idx]
+                if roles_set and (role is None or role.lower() not in roles_set):
+                    continue
+                if not visible:
                     continue
                 candidate = locator.nth(idx)
                 try:
-                    if roles_set:
-                        role = await candidate.get_attribute("role")
-                        if role is None or role.lower() not in roles_set:
-                            continue
-                    if not await candidate.is_visible():
-                        continue
-                    await candidate.click(timeout=timeout if timeout is not None else self.timeout)
-                    logger.info(f"Session {session_id} clicked text '{search_text}' (index={idx}).")
+                    await candidate.click(timeout=click_timeout)
+                    logger.info(f"Session {rec.session_id} clicked text '{search_text}' (index={idx}).")
                     return {
-                        "session_id": session_id,
+                        "session_id": rec.session_id,
                         "text": search_text,
                         "clicked_index": idx,
                         "total_candidates": candidate_count,
@@ -679,7 +1472,7 @@ class BrowserService:
                         "Failed attempt clicking text '%s' at index %s in session %s: %s",
                         search_text,
                         idx,
-                        session_id,
+                        rec.session_id,
                         click_error,
                         exc_info=True,
                     )
@@ -688,22 +1481,30 @@ class BrowserService:
             if roles_set:
                 for role in roles_set:
                     role_locator = page.get_by_role(role, name=search_text, exact=exact)
-                    role_count = await role_locator.count()
-                    for idx in range(role_count):
+                    # Visibility of every role match in one round-trip instead of count + is_visible per match
+                    role_visible = await role_locator.evaluate_all(
+                        """
+                        els => els.map(el => {
+                            const rect = el.getBoundingClientRect();
+                            return rect.width > 0 && rect.height > 0 && getComputedStyle(el).visibility !== 'hidden';
+                        })
+                        """
+                    )
+                    for idx, visible in enumerate(role_visible):
+                        if not visible:
+                            continue
                         candidate = role_locator.nth(idx)
                         try:
-                            if not await candidate.is_visible():
-                                continue
-                            await candidate.click(timeout=timeout if timeout is not None else self.timeout)
+                            await candidate.click(timeout=click_timeout)
                             logger.info(
                                 "Session %s clicked text '%s' via role '%s' (index=%s).",
-                                session_id,
+                                rec.session_id,
                                 search_text,
                                 role,
                                 idx,
                             )
                             return {
-                                "session_id": session_id,
+                                "session_id": rec.session_id,
                                 "text": search_text,
                                 "clicked_index": idx,
                                 "role": role,
@@ -717,7 +1518,7 @@ class BrowserService:
                                 search_text,
                                 role,
                                 idx,
-                                session_id,
+                                rec.session_id,
                                 click_error,
                                 exc_info=True,
                             )
@@ -727,7 +1528,7 @@ class BrowserService:
                 logger.error(
                     "Unable to click text '%s' in session %s after %s attempts: %s",
                     search_text,
-                    session_id,
+                    rec.session_id,
                     len(indices),
                     last_error,
                 )
@@ -737,119 +1538,209 @@ class BrowserService:
         except BrowserAutomationError:
             raise
         except Exception as e:
-            logger.error(f"Unexpected error clicking text '{text}' in session {session_id}: {e}", exc_info=True)
+            _log_exc("Unexpected error clicking text '%s' in session %s: %s", text, rec.session_id, e)
             raise BrowserAutomationError(f"Failed to click text '{text}': {e}")
+        finally:
+            rec.version += 1
 
+    @requires_session
     async def get_accessibility_tree(
         self,
-        session_id: str,
+        rec: SessionRecord,
         max_depth: int = 3,
         max_nodes: int = 120,
         role_filter: Optional[List[str]] = None,
         name_filter: Optional[str] = None,
         interesting_only: bool = True,
+        compact: bool = False,
+        prune_leaves: bool = False,
     ) -> Dict[str, Any]:
-        if session_id not in self.pages:
-            raise SessionNotFoundError(session_id)
+        """Return a filtered, flattened view of the page's accessibility tree.
+
+        With compact=True only AX_COMPACT_ROLES nodes are returned, and unnamed layout wrappers
+        (generic/none) don't use up max_depth, so the same budgets reach further into the page.
+        With prune_leaves=True, form controls (_AX_LEAF_ROLES) that fail the role/name filter are not
+        descended into.
+
+        The raw snapshot is cached per session and reused while no action, main-frame navigation or
+        DOM mutation has happened since (the same checks as get_page_content), so repeated inspections
+        with different filters re-walk the cached tree instead of dumping it over CDP again.
+        """
         try:
-            page = self.pages[session_id]
-            snapshot = await page.accessibility.snapshot(interesting_only=interesting_only)
+            page = rec.page
+            version = rec.version
+            dom_gen = await page.evaluate(_DOM_GENERATION_JS)
+            cached = self._ax_cache.get(rec.session_id)
+            if cached is not None and dom_gen >= 0 and cached[:3] == (version, interesting_only, dom_gen):
+                snapshot = cached[3]
+            else:
+                snapshot = await page.accessibility.snapshot(interesting_only=interesting_only)
+                if dom_gen >= 0 and rec.version == version and rec.session_id in self.sessions:
+                    self._ax_cache[rec.session_id] = (version, interesting_only, dom_gen, snapshot)
             results: List[Dict[str, Any]] = []
             role_filter_set: Optional[Set[str]] = {r.lower() for r in role_filter} if role_filter else None
             name_filter_value = name_filter.lower() if name_filter else None
 
-            def walk(node: Optional[Dict[str, Any]], depth: int, path: str) -> None:
-                if node is None or depth > max_depth or len(results) >= max_nodes:
-                    return
-
-                role = node.get("role")
-                name = node.get("name")
-                include_node = True
-                if role_filter_set and (role or "").lower() not in role_filter_set:
+            # Pre-order walk over an explicit stack (children pushed in reverse so they pop in
+            # document order); subtrees below max_depth are never pushed
+            # Hot loop: methods are bound once and the result count is a plain int
+            append = results.append
+            stack: List[Tuple[Dict[str, Any], int, str]] = [(snapshot, 0, "")] if snapshot is not None and max_depth >= 0 else []
+            pop = stack.pop
+            push = stack.append
+            added = 0
+            while stack and added < max_nodes:
+                node, depth, path = pop()
+                get = node.get
+                role = get("role")
+                name = get("name")
+                if compact and role not in AX_COMPACT_ROLES:
                     include_node = False
-                if include_node and name_filter_value and name:
-                    include_node = name_filter_value in name.lower()
-                elif include_node and name_filter_value and not name:
+                elif role_filter_set and (role or "").lower() not in role_filter_set:
                     include_node = False
+                elif name_filter_value:
+                    include_node = bool(name) and name_filter_value in name.lower()
+                else:
+                    include_node = True
 
                 if include_node:
-                    results.append(
+                    append(
                         {
                             "path": path,
                             "depth": depth,
                             "role": role,
                             "name": name,
-                            "value": node.get("value"),
-                            "description": node.get("description"),
-                            "focused": node.get("focused"),
-                            "checked": node.get("checked"),
-                            "disabled": node.get("disabled"),
-                            "actions": node.get("actions"),
+                            "value": get("value"),
+                            "description": get("description"),
+                            "focused": get("focused"),
+                            "checked": get("checked"),
+                            "disabled": get("disabled"),
+                            "actions": get("actions"),
                         }
                     )
-
-                children = node.get("children") or []
-                for idx, child in enumerate(children):
-                    if len(results) >= max_nodes:
-                        break
-                    next_path = f"{path}.{idx}" if path else str(idx)
-                    walk(child, depth + 1, next_path)
-
-            walk(snapshot, 0, "")
+                    added += 1
+
+                children = get("children")
+                # Compact mode: an unnamed wrapper's children take its own depth
+                passthrough = compact and role in _AX_WRAPPER_ROLES and not name and not get("value")
+                if children and not include_node and prune_leaves and role in _AX_LEAF_ROLES:
+                    children = None
+                if children and (passthrough or depth < max_depth):
+                    prefix = f"{path}." if path else ""
+                    child_depth = depth if passthrough else depth + 1
+                    for idx in range(len(children) - 1, -1, -1):
+                        child = children[idx]
+                        if child is not None:
+                            push((child, child_depth, f"{prefix}{idx}"))
             return {
-                "node_count": len(results),
+                "node_count": added,
                 "max_depth": max_depth,
                 "max_nodes": max_nodes,
                 "roles": role_filter,
                 "name_filter": name_filter,
+                "compact": compact,
                 "nodes": results,
             }
         except Exception as e:
-            logger.error(f"Error getting accessibility tree for session {session_id}: {e}", exc_info=True)
+            _log_exc("Error getting accessibility tree for session %s: %s", rec.session_id, e)
             raise BrowserAutomationError(f"Failed to get accessibility tree: {e}")
 
-    async def take_screenshot(self, session_id: str, full_page: bool = False, encoding: str = "base64") -> str:
-        if session_id not in self.pages:
-            raise SessionNotFoundError(session_id)
+    async def take_screenshot(self, session_id: str, full_page: bool = False, encoding: str = "base64", image_format: Optional[str] = None, quality: Optional[int] = None) -> Union[str, bytes]:
+        """Return the screenshot as a base64 string, or as raw bytes for any other encoding.
+
+        Base64 is the compatibility path for clients that need the image inline in JSON; it is a
+        third larger than the capture. Prefer take_screenshot_bytes (served over MCP as
+        resource://screenshot/{session_id}) where raw bytes can be used. Callers that need text for
+        raw bytes should encode at their own edge. When a capture is
+        byte-identical to the session's previous base64 screenshot (an unchanged page between
+        polls), the previous string is returned instead of encoding again.
+        """
+        screenshot_bytes = await self.take_screenshot_bytes(session_id, full_page=full_page, image_format=image_format, quality=quality)
+        if encoding != "base64":
+            return screenshot_bytes
         try:
-            page = self.pages[session_id]
-            screenshot_bytes = await page.screenshot(full_page=full_page)
-            if encoding == "base64":
-                import base64
-                return base64.b64encode(screenshot_bytes).decode("utf-8")
-            return screenshot_bytes.decode("latin-1") # Return as string for binary
+            # Hashing and encoding a multi-MB full-page capture inline would stall every other session
+            entry = await asyncio.to_thread(_digest_and_encode, screenshot_bytes, self._shot_cache.get(session_id))
+            if session_id in self.sessions:
+                self._shot_cache[session_id] = entry
+            return entry[1]
         except Exception as e:
-            logger.error(f"Error taking screenshot for session {session_id}: {e}", exc_info=True)
+            _log_exc("Error taking screenshot for session %s: %s", session_id, e)
             raise BrowserAutomationError(f"Failed to take screenshot: {e}")
 
-    async def take_screenshot_bytes(self, session_id: str, full_page: bool = False, image_format: str = "png", quality: Optional[int] = None) -> bytes:
+    def screenshot_format(self, image_format: Optional[str] = None) -> str:
+        """Resolve a requested screenshot format to "png", "jpeg" or "webp" (the MIME subtype).
+
+        None uses the service default (JPEG when prefer_jpeg is set); unknown formats fall back to PNG.
+        """
+        if not image_format:
+            return "jpeg" if self.prefer_jpeg else "png"
+        fmt = image_format.lower()
+        if fmt == "jpg":
+            return "jpeg"
+        return fmt if fmt in SCREENSHOT_FORMATS else "png"
+
+    @requires_session
+    async def take_screenshot_bytes(self, rec: SessionRecord, full_page: bool = False, image_format: Optional[str] = None, quality: Optional[int] = None) -> bytes:
         """Return raw screenshot bytes for use in MCP resources to avoid inline base64 in tool responses.
 
-        image_format: "png" or "jpeg". For "jpeg", optional quality (0-100) can be provided.
+        image_format: "png", "jpeg" or "webp" (None = service default, see screenshot_format).
+        quality (0-100) applies to JPEG and WebP. WebP is re-encoded from PNG off the event loop
+        and needs Pillow installed.
         """
-        if session_id not in self.pages:
-            raise SessionNotFoundError(session_id)
+        fmt = self.screenshot_format(image_format)
+        if isinstance(quality, int):
+            quality = max(0, min(100, quality))
         try:
-            page = self.pages[session_id]
-            kwargs: Dict[str, Any] = {"full_page": full_page}
-            # Playwright uses "type" to specify image format
-            if image_format in ("png", "jpeg"):
-                kwargs["type"] = image_format
-                if image_format == "jpeg" and isinstance(quality, int):
-                    # Only JPEG supports quality
-                    kwargs["quality"] = max(0, min(100, quality))
-            screenshot_bytes: bytes = await page.screenshot(**kwargs)
+            # Playwright uses "type" to specify image format; only JPEG takes a quality
+            kwargs: Dict[str, Any] = {"full_page": full_page, "type": "png" if fmt == "webp" else fmt}
+            if fmt == "jpeg":
+                kwargs["quality"] = quality if isinstance(quality, int) else SCREENSHOT_JPEG_QUALITY
+            async with self._gate(rec):
+                screenshot_bytes: bytes = await rec.page.screenshot(**kwargs)
+            if fmt == "webp":
+                screenshot_bytes = await asyncio.to_thread(
+                    _png_to_webp, screenshot_bytes, quality if isinstance(quality, int) else SCREENSHOT_WEBP_QUALITY
+                )
             return screenshot_bytes
+        except BrowserAutomationError:
+            raise
         except Exception as e:
-            logger.error(f"Error taking screenshot bytes for session {session_id}: {e}", exc_info=True)
+            _log_exc("Error taking screenshot bytes for session %s: %s", rec.session_id, e)
             raise BrowserAutomationError(f"Failed to take screenshot: {e}")
 
     async def close_all_browsers(self):
-        for session_id in list(self.pages.keys()):
-            await self.close_session(session_id)
+        # Sessions on different browsers tear down concurrently; failures are logged, not raised
+        results = await asyncio.gather(*(self.close_session(sid) for sid in list(self.sessions)), return_exceptions=True)
+        for result in results:
+            if isinstance(result, BaseException):
+                logger.warning(f"Error closing session during shutdown: {result}")
+        # Whatever is still open (warm pool, CDP connections) goes down together
+        browsers = [*self.browsers.values(), *self._cdp_browsers]
+        self.browsers.clear()
+        self._cdp_browsers.clear()
+        self._ctx_counts.clear()
+        self._browser_sema.clear()
+        self._free_browsers.clear()
+        self._free_list_of.clear()
+        self._shared_contexts.clear()
+        self._context_refs.clear()
+        self._persistent_contexts.clear()
+        self._persistent_refs.clear()
+        self._browser_uses.clear()
+        self._retiring.clear()
+        if self._refill_task is not None:
+            self._refill_task.cancel()
+            self._refill_task = None
+        self._content_cache.clear()
+        self._content_cache_chars = 0
+        self._ax_cache.clear()
+        self._shot_cache.clear()
+        await asyncio.gather(*(b.close() for b in browsers), return_exceptions=True)
         if self.playwright_instance:
             await self.playwright_instance.stop()
             self.playwright_instance = None
+            self._launchers = {}
         logger.info("All browsers and Playwright instance closed.")
 
     async def launch_chrome_with_cdp(
@@ -864,30 +1755,7 @@ class BrowserService:
         If exe_path is not provided, tries common Windows install paths and then falls back to 'chrome.exe' on PATH.
         """
         try:
-            # Resolve executable path
-            candidates: List[str] = []
-            if exe_path:
-                candidates.append(exe_path)
-            else:
-                # Common Windows paths
-                candidates += [
-                    r"C:\\Program Files\\Google\\Chrome\\Application\\chrome.exe",
-                    r"C:\\Program Files (x86)\\Google\\Chrome\\Application\\chrome.exe",
-                ]
-                # Try Edge if Chrome isn't found
-                candidates += [
-                    r"C:\\Program Files (x86)\\Microsoft\\Edge\\Application\\msedge.exe",
-                    r"C:\\Program Files\\Microsoft\\Edge\\Application\\msedge.exe",
-                ]
-
-            resolved_exe = None
-            for p in candidates:
-                if os.path.isfile(p):
-                    resolved_exe = p
-                    break
-            if not resolved_exe:
-                # Fallback to PATH
-                resolved_exe = exe_path or "chrome.exe"
+            resolved_exe = _resolve_browser_exe(exe_path)
 
             # Ensure user-data-dir
             udd = user_data_dir or os.path.join(os.getcwd(), "chrome-debug-profile")
@@ -910,7 +1778,10 @@ class BrowserService:
             else:
                 popen_kwargs["start_new_session"] = True
 
-            proc = subprocess.Popen(args, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, **popen_kwargs)
+            # Fork/exec off the event loop: it can take tens of ms for a large server process
+            proc = await asyncio.to_thread(
+                subprocess.Popen, args, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, **popen_kwargs
+            )
             cdp_url = f"http://localhost:{cdp_port}"
             logger.info(f"Launched Chrome for CDP at {cdp_url} (pid={proc.pid}) using {resolved_exe}")
             return {
@@ -920,7 +1791,7 @@ class BrowserService:
                 "user_data_dir": udd,
             }
         except Exception as e:
-            logger.error(f"Error launching Chrome with CDP: {e}", exc_info=True)
+            _log_exc("Error launching Chrome with CDP: %s", e)
             raise BrowserAutomationError(f"Failed to launch Chrome with CDP: {e}")
 
 
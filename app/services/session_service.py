@@ -1,66 +1,179 @@
-from typing import Dict, Any,List, Optional
+from typing import Dict, Any,List, Optional, Tuple, Callable, Awaitable
 import asyncio
-from datetime import datetime, timedelta
+import heapq
+import logging
+import time
+from dataclasses import dataclass
+from datetime import datetime, timezone
 from app.core.logging import get_logger
 from app.core.exceptions import SessionNotFoundError
 
 logger = get_logger(__name__)
 
+# How long read-only snapshots stay valid when no write invalidates them first.
+SESSION_VIEW_TTL_SECONDS = 0.25
+SESSION_LIST_TTL_SECONDS = 0.5
+
+# Key used in the view cache for the get_all_sessions() snapshot.
+_ALL_SESSIONS_KEY = None
+
+def _utc_iso_now() -> str:
+    return datetime.now(timezone.utc).replace(tzinfo=None).isoformat()
+
+def _monotonic_to_iso(stamp: float) -> str:
+    """Render a time.monotonic() reading as a naive UTC ISO string (the format clients have always seen)."""
+    wall = time.time() - (time.monotonic() - stamp)
+    return datetime.fromtimestamp(wall, timezone.utc).replace(tzinfo=None).isoformat()
+
+@dataclass(slots=True)
+class SessionEntry:
+    """One registered session; fixed attribute layout, touched on every activity update."""
+
+    id: str
+    # Naive UTC ISO string, formatted once at registration
+    created_at: str
+    # time.monotonic() of the last activity
+    last_activity: float
+    info: Dict[str, Any]
+
+def _session_view(session: SessionEntry) -> Dict[str, Any]:
+    # The dict shape clients see; last_activity is only formatted here, at the edge
+    return {
+        "id": session.id,
+        "created_at": session.created_at,
+        "last_activity": _monotonic_to_iso(session.last_activity),
+        "info": session.info,
+    }
+
 class SessionManager:
-    def __init__(self, session_timeout_minutes: int = 60):
-        self.sessions: Dict[str, Dict[str, Any]] = {}
+    """Tracks registered sessions, their activity and idle expiry.
+
+    Single event loop, no lock: none of the methods that read or mutate self.sessions awaits
+    while doing so, so each runs to completion before another task can touch the dict. The
+    cleanup task works from the expiry heap rather than iterating self.sessions, and
+    close_all_sessions iterates a snapshot of the keys. Keep it that way; a mutation path that
+    has to await in the middle of an update needs an asyncio.Lock.
+    """
+
+    def __init__(self, session_timeout_minutes: int = 60, on_expire: Optional[Callable[[str], Awaitable[Any]]] = None):
+        self.sessions: Dict[str, SessionEntry] = {}
         self.session_timeout_minutes = session_timeout_minutes
+        # Awaited with the session_id after an idle session is unregistered (BrowserService.close_session
+        # in the apps) so the browser side expires with it instead of outliving its registration
+        self._on_expire = on_expire
         self._cleanup_task = None
+        # Min-heap of (expiry, session_id), one entry per registration. Activity doesn't push:
+        # when an entry comes due, a session that was active since is re-pushed at its new expiry.
+        self._expiry_heap: List[Tuple[float, str]] = []
+        # Set when a registration lands on an empty heap, waking the idle cleanup task
+        self._heap_filled = asyncio.Event()
+        # Short-lived snapshots keyed by session_id (or _ALL_SESSIONS_KEY) so polling
+        # dashboards don't rebuild the same views; any write to a session drops them.
+        self._view_cache: Dict[Optional[str], Tuple[float, Any]] = {}
+
+    def _cached_view(self, key: Optional[str]) -> Any:
+        entry = self._view_cache.get(key)
+        if entry is not None and entry[0] > time.monotonic():
+            return entry[1]
+        return None
+
+    def _store_view(self, key: Optional[str], value: Any, ttl: float) -> Any:
+        self._view_cache[key] = (time.monotonic() + ttl, value)
+        return value
+
+    def _invalidate_views(self, session_id: str):
+        self._view_cache.pop(session_id, None)
+        self._view_cache.pop(_ALL_SESSIONS_KEY, None)
 
     async def register_session(self, session_id: str, session_info: Dict[str, Any]):
-        self.sessions[session_id] = {
-            "id": session_id,
-            "created_at": datetime.utcnow().isoformat(),
-            "last_activity": datetime.utcnow().isoformat(),
-            "info": session_info
-        }
+        now = time.monotonic()
+        self.sessions[session_id] = SessionEntry(id=session_id, created_at=_utc_iso_now(), last_activity=now, info=session_info)
+        if not self._expiry_heap:
+            self._heap_filled.set()
+        heapq.heappush(self._expiry_heap, (now + self.session_timeout_minutes * 60, session_id))
+        self._invalidate_views(session_id)
         logger.info(f"Session {session_id} registered.")
 
-    async def unregister_session(self, session_id: str):
-        if session_id in self.sessions:
-            del self.sessions[session_id]
-            logger.info(f"Session {session_id} unregistered.")
-        else:
+    async def unregister_session(self, session_id: str, missing_ok: bool = False):
+        """Forget a session; missing_ok tolerates one that already expired or was never registered."""
+        # One pop instead of a membership test then del; entries are never None
+        if self.sessions.pop(session_id, None) is None:
+            if missing_ok:
+                return
             raise SessionNotFoundError(session_id)
+        self._invalidate_views(session_id)
+        logger.info(f"Session {session_id} unregistered.")
+
+    async def _expire(self, session_id: str):
+        logger.info(f"Closing inactive session: {session_id}")
+        await self.unregister_session(session_id, missing_ok=True)
+        if self._on_expire is not None:
+            try:
+                await self._on_expire(session_id)
+            except SessionNotFoundError:
+                # Already closed on the browser side (explicit close or LRU eviction)
+                pass
+            except Exception as e:
+                logger.warning("Error closing expired session %s: %s", session_id, e)
 
     async def get_session_info(self, session_id: str) -> Optional[Dict[str, Any]]:
+        cached = self._cached_view(session_id)
+        if cached is not None:
+            return cached
         session = self.sessions.get(session_id)
-        if session:
-            await self.update_session_activity(session_id, "get_info")
-            return session
-        return None
+        if session is None:
+            return None
+        now = time.monotonic()
+        if now - session.last_activity > self.session_timeout_minutes * 60:
+            # Lazy expiry: an idle session is closed when it is next looked up, without waiting
+            # for the cleanup task (which remains to reclaim sessions nobody reads again)
+            await self._expire(session_id)
+            return None
+        # Reading info counts as activity but doesn't change what callers see,
+        # so touch the timestamp without dropping the cached views.
+        session.last_activity = now
+        return self._store_view(session_id, _session_view(session), SESSION_VIEW_TTL_SECONDS)
 
     async def get_all_sessions(self) -> List[Dict[str, Any]]:
-        return list(self.sessions.values())
+        cached = self._cached_view(_ALL_SESSIONS_KEY)
+        if cached is not None:
+            return cached
+        return self._store_view(_ALL_SESSIONS_KEY, [_session_view(s) for s in self.sessions.values()], SESSION_LIST_TTL_SECONDS)
 
     async def update_session_activity(self, session_id: str, activity_type: str, details: Dict[str, Any] = None):
-        if session_id in self.sessions:
-            self.sessions[session_id]["last_activity"] = datetime.utcnow().isoformat()
-            logger.debug(f"Session {session_id} activity: {activity_type}")
+        session = self.sessions.get(session_id)
+        if session is not None:
+            session.last_activity = time.monotonic()
+            self._invalidate_views(session_id)
+            # Runs on every tool call: skip even the lazy-args call unless DEBUG is on
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Session %s activity: %s", session_id, activity_type)
         else:
-            logger.warning(f"Attempted to update activity for non-existent session {session_id}.")
+            logger.warning("Attempted to update activity for non-existent session %s.", session_id)
 
     async def _cleanup_inactive_sessions(self):
+        heap = self._expiry_heap
         while True:
-            await asyncio.sleep(self.session_timeout_minutes * 60) # Check every timeout period
-            logger.info("Running inactive session cleanup.")
-            current_time = datetime.utcnow()
-            sessions_to_close = []
-            for session_id, session_data in self.sessions.items():
-                last_activity_time = datetime.fromisoformat(session_data["last_activity"])
-                if current_time - last_activity_time > timedelta(minutes=self.session_timeout_minutes):
-                    sessions_to_close.append(session_id)
-            
-            # In a real application, you would also trigger browser_service.close_session here
-            # For now, we just unregister them from the manager
-            for session_id in sessions_to_close:
-                logger.info(f"Closing inactive session: {session_id}")
-                await self.unregister_session(session_id)
+            if not heap:
+                # Nothing to expire: wait for the next registration
+                self._heap_filled.clear()
+                await self._heap_filled.wait()
+            # Sleep until the earliest expiry. A registration made meanwhile expires later than
+            # the current head, so it never needs to wake the sleep early.
+            await asyncio.sleep(max(0.0, heap[0][0] - time.monotonic()))
+            timeout = self.session_timeout_minutes * 60
+            now = time.monotonic()
+            while heap and heap[0][0] <= now:
+                _, session_id = heapq.heappop(heap)
+                session = self.sessions.get(session_id)
+                if session is None:
+                    # Unregistered since the entry was pushed
+                    continue
+                expiry = session.last_activity + timeout
+                if expiry > now:
+                    heapq.heappush(heap, (expiry, session_id))
+                    continue
+                await self._expire(session_id)
 
     def start_cleanup_task(self):
         if not self._cleanup_task or self._cleanup_task.done():
@@ -75,6 +188,7 @@ class SessionManager:
     async def close_all_sessions(self):
         for session_id in list(self.sessions.keys()):
             await self.unregister_session(session_id)
+        self._expiry_heap.clear()
         self.stop_cleanup_task()
         logger.info("All sessions closed and cleanup task stopped.")
 
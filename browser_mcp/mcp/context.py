@@ -1,6 +1,7 @@
 from __future__ import annotations
 
 import logging
+from contextvars import ContextVar
 from dataclasses import dataclass
 from typing import Optional, cast
 
@@ -22,26 +23,35 @@ class AppContext:
 logger = logging.getLogger(__name__)
 
 _current_app_context: Optional[AppContext] = None
+# Same AppContext, visible to every task spawned after the lifespan set it (stdio server): one
+# C-level lookup instead of the request_context probe. Tasks started elsewhere (e.g. the HTTP
+# transports, whose lifespan runs in its own task) miss it and fall through to the slower paths.
+_app_ctx_var: ContextVar[Optional[AppContext]] = ContextVar("app_ctx", default=None)
 
 
 def require_app_context(ctx: Optional[Context[ServerSession, AppContext]] = None) -> AppContext:
-    """Extract the application context from FastMCP request context or global state."""
+    """Extract the application context from the lifespan ContextVar, FastMCP request context or global state.
+
+    Called by every tool and resource handler, so the resolved paths don't log.
+    """
+
+    app_ctx = _app_ctx_var.get()
+    if app_ctx is not None:
+        return app_ctx
 
     if ctx is not None:
         try:
             request_context = ctx.request_context
         except ValueError:
-            logger.debug("Context request_context unavailable; falling back to global AppContext")
+            pass
         else:
             if request_context is not None and request_context.lifespan_context is not None:
-                logger.debug("Using request-scoped AppContext from lifespan context")
                 return cast(AppContext, request_context.lifespan_context)
 
     if _current_app_context is None:
         logger.error("AppContext requested but not set globally")
         raise MCPError("Application context not available.")
 
-    logger.debug("Using globally stored AppContext")
     return _current_app_context
 
 
@@ -49,9 +59,11 @@ def set_current_app_context(app_ctx: AppContext) -> None:
     global _current_app_context
     logger.debug("Setting global AppContext")
     _current_app_context = app_ctx
+    _app_ctx_var.set(app_ctx)
 
 
 def clear_current_app_context() -> None:
     global _current_app_context
     logger.debug("Clearing global AppContext")
     _current_app_context = None
+    _app_ctx_var.set(None)
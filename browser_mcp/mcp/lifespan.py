@@ -2,27 +2,45 @@ from __future__ import annotations
 
 from collections.abc import AsyncIterator
 from contextlib import asynccontextmanager
+import functools
 
 from mcp.server.fastmcp import FastMCP
 
-from app.core.config import settings
+from app.core.config import get_settings
+from app.core.exceptions import BrowserAutomationError
+from app.core.logging import get_logger
 from app.services.browser_service import BrowserService
 from app.services.session_service import SessionManager
 
 from .context import AppContext, clear_current_app_context, set_current_app_context
 
+logger = get_logger(__name__)
 
 @asynccontextmanager
 async def app_lifespan(_: FastMCP[AppContext]) -> AsyncIterator[AppContext]:
     """Manage application-wide resources for the MCP server lifecycle."""
 
+    settings = get_settings()
     browser_service = BrowserService(
         max_browsers=settings.MAX_BROWSER_INSTANCES,
         max_contexts_per_browser=settings.MAX_CONTEXTS_PER_BROWSER,
         headless=settings.BROWSER_HEADLESS,
         timeout=settings.BROWSER_TIMEOUT,
+        max_sessions=settings.MAX_CONCURRENT_SESSIONS,
+        max_uses_per_browser=settings.BROWSER_MAX_USES or None,
+        prefer_jpeg=settings.SCREENSHOT_PREFER_JPEG,
     )
-    session_manager = SessionManager()
+    # Idle-session expiry closes the browser session too, keeping both services in step
+    session_manager = SessionManager(on_expire=browser_service.close_session)
+    # ...and an LRU-evicted browser session drops its registration
+    browser_service.on_evict = functools.partial(session_manager.unregister_session, missing_ok=True)
+    # Stopped again by close_all_sessions() on shutdown
+    session_manager.start_cleanup_task()
+    # One warm Chromium is enough for the first tool call not to pay the Playwright cold start.
+    try:
+        await browser_service.start(warm_browsers=1)
+    except BrowserAutomationError as e:
+        logger.warning("Browser warm-up failed; browsers will be launched on demand: %s", e.message)
 
     app_context = AppContext(browser_service=browser_service, session_manager=session_manager)
     set_current_app_context(app_context)
@@ -2,7 +2,7 @@ from __future__ import annotations
 
 from typing import Any
 
-from app.core.exceptions import MCPError
+from app.core.exceptions import BrowserAutomationError, MCPError
 
 from .app import mcp
 from .context import require_app_context
@@ -32,3 +32,25 @@ async def session_info_resource(
     if not session_info:
         raise MCPError(f"Session not found: {session_id}")
     return {"session_id": session_id, "info": session_info, "message": "Session info retrieved."}
+
+
+@mcp.resource(
+    "resource://screenshot/{session_id}",
+    description="Live PNG screenshot of a session's viewport, returned as raw image bytes rather than inline base64.",
+    mime_type="image/png",
+)
+async def screenshot_resource(
+    session_id: str,
+) -> bytes:
+    app_ctx = require_app_context()
+    try:
+        screenshot_bytes = await app_ctx.browser_service.take_screenshot_bytes(session_id, image_format="png")
+    except BrowserAutomationError as e:
+        raise MCPError(e.message, details=e.to_dict())
+    # Polling the resource counts as activity, so a client that only reads it doesn't see the session expire
+    await app_ctx.session_manager.update_session_activity(
+        session_id,
+        "screenshot_resource",
+        {"image_format": "png", "size": len(screenshot_bytes)},
+    )
+    return screenshot_bytes
@@ -33,13 +33,17 @@ async def create_session(
     use_cdp: Optional[bool] = None,
     cdp_url: Optional[str] = None,
     create_new_page: Optional[bool] = True,
+    context_id: Optional[str] = None,
+    default_timeout: Optional[int] = None,
+    user_data_dir: Optional[str] = None,
     *,
     ctx: Context[ServerSession, AppContext],
 ) -> Dict[str, Any]:
     app_ctx = require_app_context(ctx)
     try:
         requested_cdp = bool(use_cdp)
-        auto_detect_cdp = use_cdp is None
+        # A persistent profile directory means a managed browser, so skip CDP auto-detection
+        auto_detect_cdp = use_cdp is None and not user_data_dir
         resolved_cdp_url = cdp_url or "http://localhost:9222"
         session_info: Dict[str, Any]
         used_cdp = False
@@ -71,6 +75,9 @@ async def create_session(
                 headless=headless,
                 viewport_width=viewport_width,
                 viewport_height=viewport_height,
+                context_id=context_id,
+                default_timeout=default_timeout,
+                user_data_dir=user_data_dir,
             )
             message = "Session created successfully."
         await app_ctx.session_manager.register_session(session_info["session_id"], session_info)
@@ -82,6 +89,10 @@ async def create_session(
         result: Dict[str, Any] = {"session_id": session_info["session_id"], "message": message}
         if used_cdp:
             result["cdp_url"] = session_info.get("cdp_url", resolved_cdp_url)
+        if "context_id" in session_info:
+            result["context_id"] = session_info["context_id"]
+        if "user_data_dir" in session_info:
+            result["user_data_dir"] = session_info["user_data_dir"]
         return result
     except BrowserAutomationError as e:
         logger.error("Failed to create session: %s", e.message, exc_info=True)
@@ -176,7 +187,8 @@ async def close_session(
     app_ctx = require_app_context(ctx)
     try:
         await app_ctx.browser_service.close_session(session_id)
-        await app_ctx.session_manager.unregister_session(session_id)
+        # The manager may already have dropped an idle session on its own
+        await app_ctx.session_manager.unregister_session(session_id, missing_ok=True)
         logger.info("Session %s closed successfully.", session_id)
         return {"session_id": session_id, "message": "Session closed successfully."}
     except SessionNotFoundError as e:
@@ -299,6 +311,43 @@ async def press_key(
         raise MCPError(f"Unexpected error: {e}")
 
 
+@mcp.tool(
+    description="Run a batch of actions (navigate/click/type/press) in order, wait briefly for the page to settle, and return an accessibility snapshot - one call instead of act-then-inspect round trips. Each action is an object such as {\"action\": \"click\", \"selector\": \"#go\"}."
+)
+async def chain_actions(
+    session_id: str,
+    actions: List[Dict[str, Any]],
+    settle_timeout: Optional[int] = 1500,
+    compact: Optional[bool] = True,
+    *,
+    ctx: Context[ServerSession, AppContext],
+) -> Dict[str, Any]:
+    app_ctx = require_app_context(ctx)
+    try:
+        result = await app_ctx.browser_service.chain(
+            session_id,
+            actions,
+            settle_timeout=settle_timeout if settle_timeout is not None else 1500,
+            compact=compact if compact is not None else True,
+        )
+        await app_ctx.session_manager.update_session_activity(
+            session_id,
+            "chain_actions",
+            {"steps": result["steps"], "actions": [step.get("action") for step in actions]},
+        )
+        logger.info("Session %s ran %s chained actions.", session_id, result["steps"])
+        return {**result, "message": "Actions completed."}
+    except SessionNotFoundError as e:
+        logger.warning("Chained actions on non-existent session %s.", session_id)
+        raise MCPError(f"Session not found: {session_id}", details=e.to_dict())
+    except BrowserAutomationError as e:
+        logger.error("Chained actions failed for session %s: %s", session_id, e.message, exc_info=True)
+        raise MCPError(f"Chained actions failed: {e.message}", details=e.to_dict())
+    except Exception as e:  # noqa: BLE001
+        logger.error("Unexpected error during chained actions: %s", e, exc_info=True)
+        raise MCPError(f"Unexpected error: {e}")
+
+
 @mcp.tool(
     description="Retrieve page content as HTML or plain text, optionally scoped to a selector and truncated to avoid token limits."
 )
@@ -374,7 +423,7 @@ async def take_screenshot(
     full_page: Optional[bool] = False,
     encoding: Optional[str] = "base64",
     return_image: Optional[bool] = False,
-    image_format: Optional[str] = "png",
+    image_format: Optional[str] = None,
     quality: Optional[int] = None,
     *,
     ctx: Context[ServerSession, AppContext],
@@ -393,12 +442,17 @@ async def take_screenshot(
         logger.info("Session %s requested screenshot (return_image=%s).", session_id, return_image)
 
         result: Dict[str, Any] = {"session_id": session_id, "message": "Screenshot ready."}
-        mime_type = "image/png" if (image_format or "png") == "png" else "image/jpeg"
+        # None picks the server default (PNG, or JPEG when SCREENSHOT_PREFER_JPEG is set)
+        image_format = app_ctx.browser_service.screenshot_format(image_format)
+        mime_type = f"image/{image_format}"
         if return_image:
+            # Inline data travels in JSON, so it is always base64 whatever `encoding` says
             image_data = await app_ctx.browser_service.take_screenshot(
                 session_id,
-                full_page,
-                encoding or "base64",
+                bool(full_page),
+                "base64",
+                image_format=image_format,
+                quality=quality,
             )
             result["image_data"] = image_data
             result["mime_type"] = mime_type
@@ -406,7 +460,7 @@ async def take_screenshot(
             screenshot_bytes = await app_ctx.browser_service.take_screenshot_bytes(
                 session_id,
                 full_page=bool(full_page),
-                image_format=image_format or "png",
+                image_format=image_format,
                 quality=quality,
             )
             resource_uuid = uuid4().hex
@@ -445,13 +499,15 @@ async def get_text_excerpt(
 ) -> Dict[str, Any]:
     app_ctx = require_app_context(ctx)
     try:
-        text = await app_ctx.browser_service.get_page_content(
+        limited = isinstance(max_chars, int) and max_chars > 0
+        # Truncate in the page; one extra char tells us whether anything was cut
+        text = await app_ctx.browser_service.get_page_text(
             session_id,
             selector=selector,
-            content_format="text",
+            max_chars=max_chars + 1 if limited else None,
         )
         truncated_to: Optional[int] = None
-        if isinstance(max_chars, int) and max_chars > 0 and len(text) > max_chars:
+        if limited and len(text) > max_chars:
             text = text[:max_chars]
             truncated_to = max_chars
         metrics: Dict[str, Any] = {"content_length": len(text)}
@@ -479,17 +535,8 @@ async def get_links(
 ) -> Dict[str, Any]:
     app_ctx = require_app_context(ctx)
     try:
-        if session_id not in app_ctx.browser_service.pages:
-            raise SessionNotFoundError(session_id)
-        page = app_ctx.browser_service.pages[session_id]
         scope = selector or "a"
-        all_links = await page.eval_on_selector_all(
-            scope,
-            "els => els.map(e => ({ text: (e.innerText||'').trim(), href: e.getAttribute('href') || '' }))",
-        )
-        filtered = [link for link in all_links if link.get("href")]
-        if isinstance(max_links, int) and max_links > 0:
-            filtered = filtered[:max_links]
+        filtered = await app_ctx.browser_service.get_links(session_id, selector=scope, max_links=max_links)
         await app_ctx.session_manager.update_session_activity(
             session_id,
             "get_links",
@@ -656,6 +703,8 @@ async def get_accessibility_tree(
     role_filter: Optional[List[str]] = None,
     name_filter: Optional[str] = None,
     interesting_only: Optional[bool] = True,
+    compact: Optional[bool] = False,
+    prune_leaves: Optional[bool] = False,
     *,
     ctx: Context[ServerSession, AppContext],
 ) -> Dict[str, Any]:
@@ -668,6 +717,8 @@ async def get_accessibility_tree(
             role_filter=role_filter,
             name_filter=name_filter,
             interesting_only=interesting_only if interesting_only is not None else True,
+            compact=bool(compact),
+            prune_leaves=bool(prune_leaves),
         )
         await app_ctx.session_manager.update_session_activity(
             session_id,